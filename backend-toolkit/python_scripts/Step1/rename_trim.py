@@ -3,94 +3,190 @@
 """
 Rename and trim DNA Analysis Pipeline
 Combines rename and trim operations for paired-end sequencing data.
-Modified to output only the species specified in quality_config_file.
+Outputs only the species specified in quality_config_file, all in a single pass.
 
-Usage: python rename_trim.py <R1_fastq> <R2_fastq> <barcode_csv> <quality_config_json>
+Usage: python rename_trim.py <R1_fastq> <R2_fastq> <barcode_csv> <quality_config_json> [--keep-renamed] [--matcher index|numpy|exhaustive] [--workers N] [--compress-output] [--save-matches] [--retrim]
 
 Flow:
-1. Rename R1 reads → temp files
-2. Rename R2 reads → temp files
-3. Trim paired reads using barcode file → outputs/
-4. Output ONLY the selected species files with custom quality standards
+1. Stream R1/R2 (plain or .gz) in lockstep, renaming reads on the fly
+   (--keep-renamed also writes renamed copies to outputs/rename/ for debugging)
+2. Trim each pair using barcode file → outputs/
+3. Route each pair to its species' output, using that species' quality standard
+4. Write per-species demultiplexing stats to outputs/trim/<species>.stats.json
+   and run-wide counts to outputs/trim/run.stats.json
+   (with --matcher index, pairs whose best match exceeds 2 * the loosest quality
+   standard + 1 mismatches have no known location; they are counted only in
+   run.stats.json as rejected_beyond_mismatch_cutoff; the other matchers have no cutoff)
+
+--save-matches keeps every pair's barcode match in outputs/fastq_index/, so that
+--retrim can rewrite the trim outputs for another quality config without re-matching.
 """
 
 import sys
 import os
+import io
+import gzip
 import json
+import mmap
+import queue
+import hashlib
+import argparse
+import threading
+import multiprocessing
+import time
 from pathlib import Path
-from collections import defaultdict
-from typing import Dict, List, Tuple, Optional, TextIO
+from array import array
+from collections import defaultdict, deque
+from typing import Dict, Iterator, List, Tuple, Optional, TextIO
+
+# -- shared helpers live in python_scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from seq_io import open_sequence_file
+
+try:
+    import numpy as np
+except ImportError:  # only needed for --matcher numpy
+    np = None
 
 sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 1)  # 行緩衝
 sys.stderr = os.fdopen(sys.stderr.fileno(), 'w', 1)  # 行緩衝
 
 
-def rename_fastq_file(input_file: str, output_file: str) -> None:
+class ThreadedGzipReader(io.RawIOBase):
     """
-    Rename reads in a FASTQ file by file name using read counts.
+    Binary stream over a gzip file that is decompressed on a background thread,
+    so decompression overlaps with barcode matching. Multi-member files such as
+    those written by bgzip and pigz are read to the end.
     """
-    print(f"Renaming reads in: {input_file}", flush=True)
     
-    # Ensure output directory exists
-    output_dir = os.path.dirname(output_file)
-    if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
+    def __init__(self, filename: str, block_size: int = 1 << 20, queue_blocks: int = 8):
+        super().__init__()
+        self._blocks = queue.Queue(maxsize=queue_blocks)
+        self._stop = threading.Event()
+        self._block = b''
+        self._offset = 0
+        self._eof = False
+        self._thread = threading.Thread(target=self._decompress, args=(filename, block_size), daemon=True)
+        self._thread.start()
+    
+    def _decompress(self, filename: str, block_size: int) -> None:
+        """Background thread: push decompressed blocks, then b'' at EOF (or the error)."""
+        try:
+            with open_sequence_file(filename, 'rb') as f:
+                while not self._stop.is_set():
+                    block = f.read(block_size)
+                    self._put(block)
+                    if not block:
+                        return
+        except Exception as e:
+            self._put(e)
+    
+    def _put(self, item) -> None:
+        """Queue an item, giving up if the reader was closed meanwhile."""
+        while not self._stop.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
     
-    # Extract pair identifier (R1 or R2)
+    def readable(self) -> bool:
+        return True
+    
+    def readinto(self, buffer) -> int:
+        while self._offset >= len(self._block):
+            if self._eof:
+                return 0
+            item = self._blocks.get()
+            if isinstance(item, Exception):
+                raise item
+            if not item:
+                self._eof = True
+                return 0
+            self._block, self._offset = item, 0
+        
+        size = min(len(buffer), len(self._block) - self._offset)
+        buffer[:size] = self._block[self._offset:self._offset + size]
+        self._offset += size
+        return size
+    
+    def close(self) -> None:
+        self._stop.set()
+        super().close()
+
+
+def open_fastq(filename: str) -> TextIO:
+    """Open a FASTQ file for reading as text; .gz files are decompressed on a background thread."""
+    if str(filename).endswith('.gz'):
+        return io.TextIOWrapper(io.BufferedReader(ThreadedGzipReader(filename), buffer_size=1 << 20),
+                                encoding='utf-8')
+    return open_sequence_file(filename)
+
+
+def fastq_stem(filename: str) -> str:
+    """File name without the FASTQ (and .gz) extension."""
+    name = Path(filename).name
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return Path(name).stem
+
+
+def file_fingerprint(filename: str) -> Dict:
+    """Identify a file by absolute path, size and modification time."""
+    stat = os.stat(filename)
+    return {'path': os.path.abspath(filename), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def get_pair_label(input_file: str) -> str:
+    """Return the pair identifier (R1 or R2) used when renaming reads from a FASTQ file."""
     filename = Path(input_file).name
     if '_R1' in filename:
-        pair = 'R1'
+        return 'R1'
     elif '_R2' in filename:
-        pair = 'R2'
+        return 'R2'
     else:
         # Fallback to last part before extension
-        pair = filename.split('_')[-1][0:2]
-    
-    read_counts = 0
-    
-    with open(output_file, 'w') as outfile:
-        with open(input_file, 'r') as infile:
-            for i, line in enumerate(infile):
-                line = line.rstrip()
-                if i % 4 == 0:  # Header line
-                    outfile.write("@" + pair + "_" + str(read_counts))
-                    outfile.write("\n")
-                    read_counts += 1
-                else:
-                    outfile.write(line)
-                    outfile.write("\n")
-    
-    print(f"Renamed {read_counts} reads. Output: {output_file}", flush=True)
+        return filename.split('_')[-1][0:2]
 
 
 class FastqRecord:
-    """Represents a single FASTQ record with header, sequence, and quality."""
+    """
+    Represents a single FASTQ record with header, sequence, and quality.
+    Trimming only records an offset; the trimmed sequence and quality are
+    sliced when the record is written.
+    """
+    
+    __slots__ = ('header', 'sequence', 'quality', 'index', 'offset')
     
-    def __init__(self, header: str, sequence: str, quality: str):
+    def __init__(self, header: str, sequence: str, quality: str, index: Optional[str] = None):
         self.header = header
         self.sequence = sequence
         self.quality = quality
-        self.index = self._extract_index()
+        self.index = self._extract_index() if index is None else index
+        self.offset = 0
     
     def _extract_index(self) -> str:
         """Extract read index from header."""
         return self.header.split('_')[1] if '_' in self.header else ""
     
     def trim_sequence(self, trim_length: int) -> 'FastqRecord':
-        """Return a new FastqRecord with trimmed sequence and quality."""
-        return FastqRecord(
-            self.header,
-            self.sequence[trim_length:],
-            self.quality[trim_length:]
-        )
+        """Mark the first trim_length bases as trimmed and return the record."""
+        self.offset = trim_length
+        return self
+    
+    def trimmed_sequence(self) -> str:
+        return self.sequence[self.offset:]
+    
+    def trimmed_quality(self) -> str:
+        return self.quality[self.offset:]
 
 
 class BarcodeDatabase:
     """Manages barcode and primer sequences."""
     
-    def __init__(self, tagfile: str, target_species: str):
+    def __init__(self, tagfile: str, target_species: List[str]):
         self.tags = {}
-        self.target_species = target_species  # 新增：目標物種
+        self.target_species = list(target_species)  # 目標物種（可多個）
         self.species_prefixes = set()
         self._load_tags(tagfile)
     
@@ -100,7 +196,7 @@ class BarcodeDatabase:
         print(f"Target species: {self.target_species}", flush=True)
         
         total_entries = 0
-        filtered_entries = 0
+        filtered_entries = defaultdict(int)
         
         with open(tagfile, 'r', encoding='utf-8') as f:
             for line in f:
@@ -115,69 +211,308 @@ class BarcodeDatabase:
 
                     total_entries += 1
                     
-                    if species_prefix == self.target_species:
+                    if species_prefix in self.target_species:
                         full_location_id = f"{species_prefix}_{location_field}"
                         
                         # Store: barcode_f, primer_f, barcode_r, primer_r
                         self.tags[full_location_id] = fields[2:6]
 
                         self.species_prefixes.add(species_prefix)
-                        filtered_entries += 1
+                        filtered_entries[species_prefix] += 1
         
         print(f"Total entries in barcode file: {total_entries}", flush=True)
-        print(f"Loaded {filtered_entries} entries for target species '{self.target_species}'", flush=True)
-        
-        if filtered_entries == 0:
-            print(f"WARNING: No barcode entries found for species '{self.target_species}'", flush=True)
+        for species in self.target_species:
+            print(f"Loaded {filtered_entries[species]} entries for target species '{species}'", flush=True)
+            
+            if filtered_entries[species] == 0:
+                print(f"WARNING: No barcode entries found for species '{species}'", flush=True)
     
     def get_combined_tags(self, location: str) -> Tuple[str, str]:
         """Get combined forward and reverse tags for a location."""
         barcode_f, primer_f, barcode_r, primer_r = self.tags[location]
         return barcode_f + primer_f, barcode_r + primer_r
+    
+    def max_tag_length(self) -> int:
+        """Length of the longest combined tag, i.e. the read prefix matching needs."""
+        return max((max(map(len, self.get_combined_tags(location))) for location in self.tags), default=0)
 
 
 class FastqProcessor:
-    """Processes paired-end FASTQ files."""
+    """
+    Streams paired-end FASTQ files in lockstep.
+    Reads are renamed on the fly to <pair>_<n> while they are read; renamed
+    copies are only written to rename_dir when one is given (for debugging).
+    """
     
-    def __init__(self, r1_file: str, r2_file: str):
+    def __init__(self, r1_file: str, r2_file: str, batch_size: int = 10000,
+                 rename_dir: Optional[str] = None):
         self.r1_file = r1_file
         self.r2_file = r2_file
-        self.paired_reads = {}
+        self.batch_size = batch_size
+        self.rename_dir = Path(rename_dir) if rename_dir else None
     
-    def load_reads(self) -> None:
-        """Load paired-end reads into memory."""
-        print("Loading R1 reads...", flush=True)
-        r1_reads = self._load_fastq_file(self.r1_file)
+    def iter_pairs(self) -> Iterator[Tuple[str, FastqRecord, FastqRecord]]:
+        """Yield (read_index, r1_record, r2_record) by walking R1 and R2 together."""
+        r1_reads = self._iter_fastq_file(self.r1_file)
+        r2_reads = self._iter_fastq_file(self.r2_file)
         
-        print("Loading R2 reads...", flush=True)
-        r2_reads = self._load_fastq_file(self.r2_file)
+        try:
+            while True:
+                r1_record = next(r1_reads, None)
+                r2_record = next(r2_reads, None)
+                if r1_record is None or r2_record is None:
+                    break
+                yield r1_record.index, r1_record, r2_record
+            
+            # Pairs end with the shorter file, like the old index join did; the rest
+            # of the longer file is still read so that its renamed copy is complete
+            for filename, record, reads in ((self.r1_file, r1_record, r1_reads),
+                                            (self.r2_file, r2_record, r2_reads)):
+                if record is not None:
+                    unpaired = 1 + sum(1 for _ in reads)
+                    print(f"WARNING: {filename} has {unpaired} more reads than its mate file; "
+                          f"they were left unpaired", flush=True)
+        finally:
+            r1_reads.close()
+            r2_reads.close()
+    
+    def iter_batches(self) -> Iterator[List[Tuple[str, FastqRecord, FastqRecord]]]:
+        """Yield lists of at most batch_size read pairs."""
+        batch = []
+        for pair in self.iter_pairs():
+            batch.append(pair)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    def _get_renamed_filename(self, original_file: str) -> Path:
+        """Generate renamed filename in the rename directory."""
+        self.rename_dir.mkdir(parents=True, exist_ok=True)
+        return self.rename_dir / f"{fastq_stem(original_file)}.rename.fq"
+    
+    def _iter_fastq_file(self, filename: str) -> Iterator[FastqRecord]:
+        """Yield FASTQ records one at a time, renaming headers to <pair>_<n>."""
+        pair = get_pair_label(filename)
+        renamed_file = None
+        if self.rename_dir:
+            renamed_file = open(self._get_renamed_filename(filename), 'w', encoding='utf-8')
+            print(f"Writing renamed copy of {filename} to {renamed_file.name}", flush=True)
         
-        # Combine R1 and R2 reads
-        for index in r1_reads:
-            if index in r2_reads:
-                self.paired_reads[index] = (r1_reads[index], r2_reads[index])
+        read_counts = 0
+        try:
+            with open_fastq(filename) as f:
+                while True:
+                    f.readline()  # original header, replaced below
+                    sequence = f.readline()
+                    separator = f.readline()
+                    quality = f.readline()
+                    
+                    # Stop at EOF or on a truncated trailing record
+                    if not quality:
+                        break
+                    
+                    index = str(read_counts)
+                    header = f"@{pair}_{index}"
+                    read_counts += 1
+                    
+                    if renamed_file:
+                        renamed_file.write(f"{header}\n{sequence.rstrip()}\n{separator.rstrip()}\n{quality.rstrip()}\n")
+                    
+                    yield FastqRecord(header, sequence.strip(), quality.strip(), index)
+        finally:
+            if renamed_file:
+                renamed_file.close()
+
+
+class FastqIndex:
+    """
+    Byte offsets of every record's sequence and quality line in a plain FASTQ
+    file, built in one scan of the memory-mapped file and kept in compact
+    arrays. Records are read back as zero-copy slices of the mmap, so the OS
+    page cache does the caching. The index is saved to index_dir and reused
+    for as long as the FASTQ file is unchanged.
+    """
+    
+    WHITESPACE = b' \t\r\n\x0b\x0c'
+    
+    def __init__(self, fastq_file: str, index_dir: str):
+        self.fastq_file = fastq_file
+        self.index_path = Path(index_dir) / f"{fastq_stem(fastq_file)}.fqi"
         
-        print(f"Loaded {len(self.paired_reads)} paired reads", flush=True)
+        self.seq_starts = array('Q')
+        self.seq_lens = array('I')
+        self.qual_starts = array('Q')
+        self.qual_lens = array('I')
+        
+        self._file = open(fastq_file, 'rb')
+        # -- an empty file cannot be memory-mapped; it simply has no records
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._data = self._mmap
+        else:
+            self._mmap = None
+            self._data = b''
+        self._view = memoryview(self._data)
+        
+        if not self._load():
+            self._build()
+            self._save()
+    
+    def __len__(self) -> int:
+        return len(self.seq_starts)
     
-    def _load_fastq_file(self, filename: str) -> Dict[str, FastqRecord]:
-        """Load FASTQ file and return dictionary of reads indexed by read index."""
-        reads = {}
+    def _strip(self, start: int, end: int) -> Tuple[int, int]:
+        """Offsets of a line with surrounding whitespace removed, like str.strip()."""
+        line = self._data[start:end]
+        start += len(line) - len(line.lstrip(self.WHITESPACE))
+        return start, start + len(line.strip(self.WHITESPACE))
+    
+    def _build(self) -> None:
+        """Scan the file once, recording where each sequence and quality line lies."""
+        print(f"Building FASTQ offset index: {self.fastq_file}", flush=True)
+        find = self._data.find
+        size = len(self._data)
+        position = 0
         
-        with open(filename, 'r', encoding='utf-8') as f:
-            lines = [line.strip() for line in f]
+        while True:
+            # header, sequence and '+' lines must be complete
+            line_ends = []
+            for _ in range(3):
+                line_end = find(b'\n', position)
+                if line_end < 0:
+                    break
+                line_ends.append(line_end)
+                position = line_end + 1
+            
+            # Stop at EOF or on a truncated trailing record
+            if len(line_ends) < 3 or position >= size:
+                break
+            
+            qual_end = find(b'\n', position)
+            if qual_end < 0:
+                qual_end = size
+            
+            seq_start, seq_end = self._strip(line_ends[0] + 1, line_ends[1])
+            qual_start, qual_end_stripped = self._strip(position, qual_end)
+            self.seq_starts.append(seq_start)
+            self.seq_lens.append(seq_end - seq_start)
+            self.qual_starts.append(qual_start)
+            self.qual_lens.append(qual_end_stripped - qual_start)
+            
+            position = qual_end + 1
         
-        # Process FASTQ in chunks of 4 lines
-        for i in range(0, len(lines), 4):
-            if i + 3 < len(lines):
-                header = lines[i]
-                sequence = lines[i + 1]
-                quality = lines[i + 3]
-                
-                record = FastqRecord(header, sequence, quality)
-                if record.index:
-                    reads[record.index] = record
+        print(f"Indexed {len(self)} records", flush=True)
+    
+    def _arrays(self) -> List[array]:
+        return [self.seq_starts, self.seq_lens, self.qual_starts, self.qual_lens]
+    
+    def _save(self) -> None:
+        """Write the index as a JSON header line followed by the raw arrays."""
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        meta = {'source': file_fingerprint(self.fastq_file), 'records': len(self)}
+        with open(self.index_path, 'wb') as f:
+            f.write(json.dumps(meta).encode('utf-8') + b'\n')
+            for values in self._arrays():
+                values.tofile(f)
+    
+    def _load(self) -> bool:
+        """
+        Load a saved index if it belongs to the current FASTQ file. A truncated
+        or corrupt index counts as stale, and is rebuilt.
+        """
+        if not self.index_path.exists():
+            return False
         
-        return reads
+        try:
+            with open(self.index_path, 'rb') as f:
+                meta = json.loads(f.readline())
+                if not isinstance(meta, dict) or meta.get('source') != file_fingerprint(self.fastq_file):
+                    return False
+                for values in self._arrays():
+                    values.fromfile(f, meta['records'])
+                if f.read(1):
+                    raise ValueError("trailing data")
+        except (OSError, ValueError, EOFError, KeyError, TypeError) as e:
+            print(f"Ignoring unreadable FASTQ offset index {self.index_path}: {e}", flush=True)
+            for values in self._arrays():
+                del values[:]
+            return False
+        
+        print(f"Loaded FASTQ offset index: {self.index_path} ({len(self)} records)", flush=True)
+        return True
+    
+    def sequence(self, i: int) -> memoryview:
+        start = self.seq_starts[i]
+        return self._view[start:start + self.seq_lens[i]]
+    
+    def quality(self, i: int) -> memoryview:
+        start = self.qual_starts[i]
+        return self._view[start:start + self.qual_lens[i]]
+    
+    def record(self, i: int, header: str = "") -> FastqRecord:
+        """Materialize record i as a FastqRecord."""
+        return FastqRecord(header, str(self.sequence(i), 'utf-8'), str(self.quality(i), 'utf-8'), str(i))
+    
+    def close(self) -> None:
+        self._view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+
+class MatchTable:
+    """
+    Best barcode match of every read pair in input order, saved with
+    --save-matches so that --retrim can rewrite the trim outputs for a new
+    quality config without re-reading or re-matching the reads.
+    Location -1 marks a pair without a match, -2 a pair the index matcher
+    rejected beyond its mismatch cutoff; orientation 0 is R1f, 1 is R2f.
+    """
+    
+    def __init__(self):
+        self.locations = array('i')
+        self.orientations = array('b')
+        self.mismatch_f = array('h')
+        self.mismatch_r = array('h')
+    
+    def __len__(self) -> int:
+        return len(self.locations)
+    
+    def append(self, location_no: int, orientation: str, mismatch_f: int, mismatch_r: int) -> None:
+        self.locations.append(location_no)
+        self.orientations.append(0 if orientation == "R1f" else 1)
+        self.mismatch_f.append(mismatch_f)
+        self.mismatch_r.append(mismatch_r)
+    
+    def append_unmatched(self) -> None:
+        self.append(-1, "R1f", 0, 0)
+    
+    def append_rejected(self) -> None:
+        self.append(-2, "R1f", 0, 0)
+    
+    def _arrays(self) -> List[array]:
+        return [self.locations, self.orientations, self.mismatch_f, self.mismatch_r]
+    
+    def save(self, path: Path, meta: Dict) -> None:
+        """Write the table as a JSON header line followed by the raw arrays."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        meta = dict(meta, pairs=len(self))
+        with open(path, 'wb') as f:
+            f.write(json.dumps(meta).encode('utf-8') + b'\n')
+            for values in self._arrays():
+                values.tofile(f)
+        print(f"Saved barcode matches of {len(self)} read pairs: {path}", flush=True)
+    
+    @classmethod
+    def load(cls, path: Path) -> Tuple['MatchTable', Dict]:
+        table = cls()
+        with open(path, 'rb') as f:
+            meta = json.loads(f.readline())
+            for values in table._arrays():
+                values.fromfile(f, meta['pairs'])
+        return table, meta
 
 
 class SequenceMatcher:
@@ -216,25 +551,380 @@ class SequenceMatcher:
             return "R2f", mismatch_r2f, mismatch_r1r, len_tag_f, len_tag_r
 
 
+class ExhaustiveBarcodeMatcher:
+    """Scores every location in the barcode database against each read pair."""
+    
+    def __init__(self, barcode_db: BarcodeDatabase):
+        self.barcode_db = barcode_db
+        self.matcher = SequenceMatcher()
+    
+    def find_best_match(self, r1_seq: str, r2_seq: str) -> Optional[Tuple]:
+        """Find the best barcode match for a read pair."""
+        best_mismatch = float('inf')
+        best_match = None
+        
+        # 只在目標物種的條碼中搜尋
+        for location in self.barcode_db.tags.keys():
+            tag_f, tag_r = self.barcode_db.get_combined_tags(location)
+            
+            orientation, mismatch_f, mismatch_r, f_len, r_len = self.matcher.find_best_orientation(
+                tag_f, tag_r, r1_seq, r2_seq
+            )
+            
+            total_mismatch = mismatch_f + mismatch_r
+            
+            if total_mismatch < best_mismatch:
+                best_mismatch = total_mismatch
+                best_match = (location, orientation, mismatch_f, mismatch_r, f_len, r_len)
+        
+        return best_match
+    
+    def match_batch(self, r1_seqs: List[str], r2_seqs: List[str]) -> List[Optional[Tuple]]:
+        """Return the best match tuple (or None) for each read pair."""
+        return [self.find_best_match(r1_seq, r2_seq) for r1_seq, r2_seq in zip(r1_seqs, r2_seqs)]
+
+
+# Returned by BarcodeIndex instead of a match tuple for pairs that can be
+# compared with the barcodes but whose best match is beyond its mismatch cutoff
+REJECTED_MATCH = "rejected"
+
+
+class BarcodeIndex:
+    """
+    Pigeonhole index over the combined barcode+primer tags.
+    
+    Each tag is split into max_mismatch + 1 segments; a read prefix within
+    max_mismatch mismatches of a tag must match at least one segment exactly,
+    so a few dict lookups give the candidate locations and only those are
+    scored with SequenceMatcher. Any location that is not a candidate has more
+    than max_mismatch mismatches on every tag comparison, so whenever the best
+    candidate totals at most 2 * max_mismatch + 1 it is also the best location
+    overall. Pairs with no such candidate cannot pass a quality standard of
+    max_mismatch and are reported as REJECTED_MATCH (their best location and
+    mismatches are not computed); pairs too short for every tag are unmatched,
+    as with the exhaustive search.
+    """
+    
+    def __init__(self, barcode_db: BarcodeDatabase, max_mismatch: int):
+        self.barcode_db = barcode_db
+        self.max_mismatch = max_mismatch
+        self.locations = list(barcode_db.tags.keys())
+        self.mismatch_cutoff = 2 * max_mismatch + 1
+        self.tag_lengths = {tuple(map(len, barcode_db.get_combined_tags(location))) for location in self.locations}
+        
+        # {tag length: [(start, end), ...]} and {(tag length, segment no): {segment: [location no, ...]}}
+        self.f_segments, self.f_index = {}, {}
+        self.r_segments, self.r_index = {}, {}
+        
+        for position, location in enumerate(self.locations):
+            tag_f, tag_r = barcode_db.get_combined_tags(location)
+            self._add_tag(tag_f.upper(), position, self.f_segments, self.f_index)
+            self._add_tag(tag_r.upper(), position, self.r_segments, self.r_index)
+        
+        print(f"Built barcode index: {len(self.locations)} locations, "
+              f"{max_mismatch + 1} segments per tag", flush=True)
+    
+    def _add_tag(self, tag: str, position: int, segments: Dict, index: Dict) -> None:
+        """Register every pigeonhole segment of a tag."""
+        tag_len = len(tag)
+        if tag_len not in segments:
+            parts = self.max_mismatch + 1
+            bounds = [tag_len * i // parts for i in range(parts + 1)]
+            segments[tag_len] = list(zip(bounds[:-1], bounds[1:]))
+        
+        for segment_no, (start, end) in enumerate(segments[tag_len]):
+            index.setdefault((tag_len, segment_no), {}).setdefault(tag[start:end], []).append(position)
+    
+    @staticmethod
+    def _lookup(read_seq: str, segments: Dict, index: Dict, candidates: set) -> None:
+        """Add the locations sharing an exact segment with the read prefix."""
+        read_len = len(read_seq)
+        for tag_len, bounds in segments.items():
+            if read_len < tag_len:
+                continue
+            for segment_no, (start, end) in enumerate(bounds):
+                hits = index[(tag_len, segment_no)].get(read_seq[start:end])
+                if hits:
+                    candidates.update(hits)
+    
+    def find_best_match(self, r1_seq: str, r2_seq: str) -> Optional[Tuple]:
+        """Same result as the exhaustive search for every pair within max_mismatch per tag."""
+        r1_seq = r1_seq.upper()
+        r2_seq = r2_seq.upper()
+        
+        candidates = set()
+        for read_seq in (r1_seq, r2_seq):
+            self._lookup(read_seq, self.f_segments, self.f_index, candidates)
+            self._lookup(read_seq, self.r_segments, self.r_index, candidates)
+        
+        best_mismatch = float('inf')
+        best_match = None
+        
+        # Walk candidates in barcode file order so ties resolve as before
+        for position in sorted(candidates):
+            location = self.locations[position]
+            tag_f, tag_r = self.barcode_db.get_combined_tags(location)
+            
+            orientation, mismatch_f, mismatch_r, f_len, r_len = SequenceMatcher.find_best_orientation(
+                tag_f, tag_r, r1_seq, r2_seq
+            )
+            
+            total_mismatch = mismatch_f + mismatch_r
+            
+            if total_mismatch < best_mismatch:
+                best_mismatch = total_mismatch
+                best_match = (location, orientation, mismatch_f, mismatch_r, f_len, r_len)
+        
+        if best_mismatch > self.mismatch_cutoff:
+            return REJECTED_MATCH if self._comparable(r1_seq, r2_seq) else None
+        return best_match
+    
+    def _comparable(self, r1_seq: str, r2_seq: str) -> bool:
+        """Whether the exhaustive search would score the pair, i.e. it fits some tag pair in one orientation."""
+        r1_len, r2_len = len(r1_seq), len(r2_seq)
+        return any((r1_len >= f_len and r2_len >= r_len) or (r2_len >= f_len and r1_len >= r_len)
+                   for f_len, r_len in self.tag_lengths)
+    
+    def match_batch(self, r1_seqs: List[str], r2_seqs: List[str]) -> List[Optional[Tuple]]:
+        """Return the best match tuple (or None) for each read pair."""
+        return [self.find_best_match(r1_seq, r2_seq) for r1_seq, r2_seq in zip(r1_seqs, r2_seqs)]
+
+
+class NumpyBarcodeMatcher:
+    """
+    Batched barcode matching with NumPy.
+    
+    Read prefixes are encoded into uint8 arrays and compared against every
+    tag_f/tag_r at once; the best location and orientation are picked with
+    argmin. Ties resolve like the exhaustive search (R1f first, then the
+    earliest location in the barcode file), so results are identical.
+    """
+    
+    # Stands in for the infinite distance of a read shorter than the tag
+    TOO_SHORT = 1 << 20
+    
+    def __init__(self, barcode_db: BarcodeDatabase, max_cells: int = 1 << 24):
+        if np is None:
+            raise ImportError("The numpy barcode matcher requires NumPy to be installed")
+        
+        self.locations = list(barcode_db.tags.keys())
+        combined_tags = [barcode_db.get_combined_tags(location) for location in self.locations]
+        
+        self.prefix_len = max((max(len(tag_f), len(tag_r)) for tag_f, tag_r in combined_tags), default=0)
+        self.f_tags, self.f_lens = self._encode([tag_f for tag_f, _ in combined_tags])
+        self.r_tags, self.r_lens = self._encode([tag_r for _, tag_r in combined_tags])
+        
+        # Only compare positions inside each tag
+        positions = np.arange(self.prefix_len)
+        self.f_mask = positions[None, :] < self.f_lens[:, None]
+        self.r_mask = positions[None, :] < self.r_lens[:, None]
+        
+        # Bound the (reads x locations x positions) comparison size
+        self.chunk_size = max(1, max_cells // max(1, len(self.locations) * self.prefix_len))
+    
+    def _encode(self, seqs: List[str]) -> Tuple:
+        """Encode upper-cased sequence prefixes as a zero-padded uint8 matrix plus lengths."""
+        prefix_len = self.prefix_len
+        buffer = b''.join(
+            seq[:prefix_len].upper().encode('latin-1').ljust(prefix_len, b'\0') for seq in seqs
+        )
+        encoded = np.frombuffer(buffer, dtype=np.uint8).reshape(len(seqs), prefix_len)
+        lengths = np.fromiter((len(seq) for seq in seqs), dtype=np.int32, count=len(seqs))
+        return encoded, lengths
+    
+    def _mismatches(self, reads, read_lens, tags, tag_lens, mask):
+        """Mismatch counts of shape (reads, locations)."""
+        counts = ((reads[:, None, :] != tags[None, :, :]) & mask[None, :, :]).sum(axis=2, dtype=np.int32)
+        counts[read_lens[:, None] < tag_lens[None, :]] = self.TOO_SHORT
+        return counts
+    
+    def match_batch(self, r1_seqs: List[str], r2_seqs: List[str]) -> List[Optional[Tuple]]:
+        """Return the best match tuple (or None) for each read pair."""
+        if not self.locations:
+            return [None] * len(r1_seqs)
+        
+        matches = []
+        for start in range(0, len(r1_seqs), self.chunk_size):
+            r1, r1_lens = self._encode(r1_seqs[start:start + self.chunk_size])
+            r2, r2_lens = self._encode(r2_seqs[start:start + self.chunk_size])
+            
+            mismatch_r1f = self._mismatches(r1, r1_lens, self.f_tags, self.f_lens, self.f_mask)
+            mismatch_r2r = self._mismatches(r2, r2_lens, self.r_tags, self.r_lens, self.r_mask)
+            mismatch_r2f = self._mismatches(r2, r2_lens, self.f_tags, self.f_lens, self.f_mask)
+            mismatch_r1r = self._mismatches(r1, r1_lens, self.r_tags, self.r_lens, self.r_mask)
+            
+            r1f_total = mismatch_r1f + mismatch_r2r
+            r2f_total = mismatch_r2f + mismatch_r1r
+            use_r1f = r1f_total <= r2f_total
+            total = np.where(use_r1f, r1f_total, r2f_total)
+            
+            rows = np.arange(len(total))
+            best = total.argmin(axis=1)
+            found = total[rows, best] < self.TOO_SHORT
+            best_r1f = use_r1f[rows, best]
+            mismatch_f = np.where(best_r1f, mismatch_r1f[rows, best], mismatch_r2f[rows, best])
+            mismatch_r = np.where(best_r1f, mismatch_r2r[rows, best], mismatch_r1r[rows, best])
+            
+            for row, position in enumerate(best.tolist()):
+                if not found[row]:
+                    matches.append(None)
+                    continue
+                matches.append((
+                    self.locations[position],
+                    "R1f" if best_r1f[row] else "R2f",
+                    int(mismatch_f[row]),
+                    int(mismatch_r[row]),
+                    int(self.f_lens[position]),
+                    int(self.r_lens[position])
+                ))
+        
+        return matches
+
+
+# Barcode matcher of a worker process, set once by _init_match_worker
+_worker_matcher = None
+
+
+def _init_match_worker(barcode_matcher) -> None:
+    """Pool initializer: keep the matcher shipped from the parent process."""
+    global _worker_matcher
+    _worker_matcher = barcode_matcher
+
+
+def _match_in_worker(r1_seqs: List[str], r2_seqs: List[str]) -> List[Optional[Tuple]]:
+    """Match one chunk of read prefixes in a worker process."""
+    return _worker_matcher.match_batch(r1_seqs, r2_seqs)
+
+
+# -- run-wide counters, next to the per-species <species>.stats.json sidecars
+RUN_STATS_FILE = "run.stats.json"
+
+
+class DemultiplexStats:
+    """
+    Counters accumulated while demultiplexing, written per species as
+    trim/<species>.stats.json. Mismatch histograms cover every pair whose best
+    match belongs to the species; location and orientation counts cover the
+    pairs that passed its quality standard and were written.
+    
+    With the index matcher, pairs beyond its mismatch cutoff are rejected
+    without a known location, so they cannot be attributed to a species: they
+    are counted once for the whole run in trim/run.stats.json
+    (rejected_beyond_mismatch_cutoff) and the histograms stop at the cutoff.
+    """
+    
+    def __init__(self, quality_config: Dict[str, int]):
+        self.quality_config = quality_config
+        self.unmatched_pairs = 0
+        self.location_counts = {species: defaultdict(int) for species in quality_config}
+        self.orientation_counts = {species: defaultdict(int) for species in quality_config}
+        self.mismatch_f_histogram = {species: defaultdict(int) for species in quality_config}
+        self.mismatch_r_histogram = {species: defaultdict(int) for species in quality_config}
+        self.rejected_counts = defaultdict(int)
+        self.rejected_beyond_cutoff = 0
+        self.mismatch_cutoff = None
+    
+    def record_unmatched(self) -> None:
+        self.unmatched_pairs += 1
+    
+    def record_rejected_beyond_cutoff(self) -> None:
+        self.rejected_beyond_cutoff += 1
+    
+    def record_match(self, location: str, orientation: str, mismatch_f: int, mismatch_r: int,
+                     written: bool) -> None:
+        species = location.split('_')[0] if '_' in location else location
+        if species not in self.quality_config:
+            return
+        
+        self.mismatch_f_histogram[species][mismatch_f] += 1
+        self.mismatch_r_histogram[species][mismatch_r] += 1
+        if written:
+            self.location_counts[species][location] += 1
+            self.orientation_counts[species][orientation] += 1
+        else:
+            self.rejected_counts[species] += 1
+    
+    def written_pairs(self, species: str) -> int:
+        return sum(self.location_counts[species].values())
+    
+    def write(self, output_dir: Path, processed_count: int, elapsed: float) -> None:
+        """Write one stats sidecar per species and one for the whole run."""
+        read_pairs_per_second = round(processed_count / elapsed, 1) if elapsed > 0 else None
+        run_stats = {
+            'processed_pairs': processed_count,
+            'unmatched_pairs': self.unmatched_pairs,
+            'rejected_beyond_mismatch_cutoff': self.rejected_beyond_cutoff,
+            'mismatch_cutoff': self.mismatch_cutoff,
+            'elapsed_seconds': round(elapsed, 3),
+            'read_pairs_per_second': read_pairs_per_second
+        }
+        with open(Path(output_dir) / RUN_STATS_FILE, 'w', encoding='utf-8') as f:
+            json.dump(run_stats, f, indent=2)
+            f.write("\n")
+        
+        for species, quality_standard in self.quality_config.items():
+            stats = {
+                'species': species,
+                'quality_standard': quality_standard,
+                'written_pairs': self.written_pairs(species),
+                'rejected_by_quality_standard': self.rejected_counts[species],
+                'mismatch_cutoff': self.mismatch_cutoff,
+                'pairs_per_location': dict(sorted(self.location_counts[species].items())),
+                'orientation_counts': dict(sorted(self.orientation_counts[species].items())),
+                'mismatch_f_histogram': {str(k): v for k, v in sorted(self.mismatch_f_histogram[species].items())},
+                'mismatch_r_histogram': {str(k): v for k, v in sorted(self.mismatch_r_histogram[species].items())},
+                'processed_pairs': processed_count,
+                'unmatched_pairs': self.unmatched_pairs,
+                'elapsed_seconds': round(elapsed, 3),
+                'read_pairs_per_second': read_pairs_per_second
+            }
+            
+            with open(get_stats_path(output_dir, species), 'w', encoding='utf-8') as f:
+                json.dump(stats, f, indent=2)
+                f.write("\n")
+
+
+def get_stats_path(output_dir: Path, species: str) -> Path:
+    """Path of a species' demultiplexing stats sidecar."""
+    return Path(output_dir) / f"{species}.stats.json"
+
+
 class OutputManager:
-    """Manages output files for the target species only."""
+    """Manages output files for the configured species, each with its own quality standard."""
     
-    def __init__(self, target_species: str, quality_standard: int, output_dir: str = "/app/data/outputs/trim"):
+    def __init__(self, quality_config: Dict[str, int], output_dir: str = "/app/data/outputs/trim",
+                 compress: bool = False):
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.file_handles = {}
+        self.compress = compress
         
-        self.target_species = target_species
-        self.quality_standard = quality_standard
-        print(f"Target species: {target_species}, Quality standard: {quality_standard}", flush=True)
+        self.quality_config = quality_config
+        self.written_counts = defaultdict(int)
+        self.stats = DemultiplexStats(quality_config)
+        for species, quality_standard in quality_config.items():
+            print(f"Target species: {species}, Quality standard: {quality_standard}", flush=True)
     
     def open_output_files(self) -> None:
-        """Open output files for the target species only."""
-        self.file_handles[self.target_species] = {
-            'F': open(self.output_dir / f"{self.target_species}.f.fq", 'w', encoding='utf-8'),
-            'R': open(self.output_dir / f"{self.target_species}.r.fq", 'w', encoding='utf-8')
-        }
-        print(f"Opened output files for species: {self.target_species}", flush=True)
+        """Open output files for every configured species."""
+        for species in self.quality_config:
+            self.file_handles[species] = {
+                'F': self._open_output(self.get_output_path(species, 'f')),
+                'R': self._open_output(self.get_output_path(species, 'r'))
+            }
+            print(f"Opened output files for species: {species}", flush=True)
+    
+    def get_output_path(self, species: str, direction: str) -> Path:
+        """Path of a species' forward ('f') or reverse ('r') trim output."""
+        suffix = ".fq.gz" if self.compress else ".fq"
+        return self.output_dir / f"{species}.{direction}{suffix}"
+    
+    def _open_output(self, path: Path) -> TextIO:
+        """Open an output file, gzip-compressed when requested."""
+        if self.compress:
+            # Level 1 keeps compression from becoming the bottleneck
+            return gzip.open(path, 'wt', compresslevel=1, encoding='utf-8')
+        return open(path, 'w', encoding='utf-8')
     
     def close_all_files(self) -> None:
         """Close all open file handles."""
@@ -242,20 +932,28 @@ class OutputManager:
             for file_handle in species_files.values():
                 file_handle.close()
     
+    def passes_quality(self, location: str, mismatch_f: int, mismatch_r: int) -> bool:
+        """Whether a match belongs to a target species and is within its quality standard."""
+        species_prefix = location.split('_')[0] if '_' in location else location
+        
+        # 只處理目標物種
+        quality_standard = self.quality_config.get(species_prefix)
+        if quality_standard is None:
+            return False
+        
+        # 品質控制：檢查錯配是否超過該物種的標準
+        return mismatch_f <= quality_standard and mismatch_r <= quality_standard
+    
     def write_trimmed_reads(self, read_index: str, location: str, orientation: str,
                            r1_record: FastqRecord, r2_record: FastqRecord,
                            mismatch_f: int, mismatch_r: int,
                            f_trim_len: int, r_trim_len: int) -> bool:
         """Write trimmed reads to output files. Returns True if written, False if filtered out."""
-        species_prefix = location.split('_')[0] if '_' in location else location
-        
-        # 只處理目標物種
-        if species_prefix != self.target_species:
+        if not self.passes_quality(location, mismatch_f, mismatch_r):
+            self.stats.record_match(location, orientation, mismatch_f, mismatch_r, written=False)
             return False
         
-        # 品質控制：檢查錯配是否超過標準
-        if mismatch_f > self.quality_standard or mismatch_r > self.quality_standard:
-            return False
+        species_prefix = location.split('_')[0] if '_' in location else location
         
         # Determine correct orientation and trim sequences
         if orientation == "R1f":
@@ -267,14 +965,16 @@ class OutputManager:
         
         # Write forward read
         f_header = f"@{orientation}_{read_index}_{location}"
-        self._write_fastq_record(self.file_handles[self.target_species]['F'], 
-                                f_header, f_record.sequence, f_record.quality)
+        self._write_fastq_record(self.file_handles[species_prefix]['F'], 
+                                f_header, f_record.trimmed_sequence(), f_record.trimmed_quality())
         
         # Write reverse read  
         r_header = f"@{orientation}_{read_index}_{location}"
-        self._write_fastq_record(self.file_handles[self.target_species]['R'],
-                                r_header, r_record.sequence, r_record.quality)
+        self._write_fastq_record(self.file_handles[species_prefix]['R'],
+                                r_header, r_record.trimmed_sequence(), r_record.trimmed_quality())
         
+        self.written_counts[species_prefix] += 1
+        self.stats.record_match(location, orientation, mismatch_f, mismatch_r, written=True)
         return True
     
     def _write_fastq_record(self, file_handle: TextIO, header: str, sequence: str, quality: str) -> None:
@@ -285,200 +985,346 @@ class OutputManager:
 class IntegratedPipeline:
     """Main pipeline that integrates rename and trim operations."""
     
-    def __init__(self, r1_file: str, r2_file: str, barcode_file: str, quality_config: Dict[str, int]):
+    def __init__(self, r1_file: str, r2_file: str, barcode_file: str, quality_config: Dict[str, int],
+                 keep_renamed: bool = False, matcher: str = "index", workers: int = 1,
+                 compress_output: bool = False, save_matches: bool = False, retrim: bool = False):
         self.r1_file = r1_file
         self.r2_file = r2_file
         self.barcode_file = barcode_file
+        self.keep_renamed = keep_renamed
+        self.matcher_engine = matcher
+        self.workers = workers
+        self.compress_output = compress_output
+        self.save_matches = save_matches
+        self.retrim = retrim
         
         # 取得目標物種和品質標準
-        if len(quality_config) != 1:
-            raise ValueError(f"Quality config should contain exactly one species, got: {list(quality_config.keys())}")
+        if not quality_config:
+            raise ValueError("Quality config should contain at least one species")
+        
+        self.quality_config = dict(quality_config)
+        self.target_species = list(self.quality_config.keys())
         
-        self.target_species = list(quality_config.keys())[0]
-        self.quality_standard = quality_config[self.target_species]
+        for species, quality_standard in self.quality_config.items():
+            print(f"Pipeline configured for species: {species} (quality standard: {quality_standard})", flush=True)
         
-        print(f"Pipeline configured for species: {self.target_species} (quality standard: {self.quality_standard})", flush=True)
+        # Renamed copies are only written on request (debugging)
+        self.rename_dir = "/app/data/outputs/rename" if keep_renamed else None
         
-        # Generate temporary file names for renamed files
-        self.r1_renamed = self._get_renamed_filename(r1_file)
-        self.r2_renamed = self._get_renamed_filename(r2_file)
+        # Offset indexes and saved matches live outside the per-run output directories
+        self.index_dir = "/app/data/outputs/fastq_index"
+        self.match_table_path = Path(self.index_dir) / f"{fastq_stem(r1_file)}.matches"
+        self.match_table = None
         
         # Initialize trim components
         self.barcode_db = None
         self.fastq_processor = None
         self.output_manager = None
-        self.matcher = SequenceMatcher()
+        self.barcode_matcher = None
         
         # Results tracking
-        self.results = {}
+        self.processed_count = 0
+        self.written_count = 0
 
-    def _get_renamed_filename(self, original_file: str) -> str:
-        """Generate renamed filename in outputs/rename directory."""
-        file_path = Path(original_file)
-        filename = file_path.stem
-        
-        rename_dir = Path("/app/data/outputs/rename")
-        rename_dir.mkdir(parents=True, exist_ok=True)
-        
-        return str(rename_dir / f"{filename}.rename.fq")
-    
     def run(self) -> None:
         """Run the complete rename and trim pipeline."""
         print("Starting data pre-processing...", flush=True)
         print(f"Input files: {self.r1_file}, {self.r2_file}", flush=True)
         print(f"Barcode file: {self.barcode_file}", flush=True)
-        print(f"Target species: {self.target_species} (quality standard: {self.quality_standard})", flush=True)
+        for species, quality_standard in self.quality_config.items():
+            print(f"Target species: {species} (quality standard: {quality_standard})", flush=True)
         
         try:
-            print("\n>> [1/4] Pre-processing: Renaming R1 reads...", flush=True)
-            rename_fastq_file(self.r1_file, self.r1_renamed)
-            
-            print("\n>> [2/4] Pre-processing: Renaming R2 reads...", flush=True)
-            rename_fastq_file(self.r2_file, self.r2_renamed)
-            
-            print("\n>> [3/4] Core Analysis: Barcode trimming & Demultiplexing...", flush=True)
-            self._run_trim_analysis()
+            if self.retrim:
+                print("\n>> [1/2] Core Analysis: Re-trimming from saved barcode matches...", flush=True)
+                self._run_retrim()
+            else:
+                print("\n>> [1/2] Core Analysis: Renaming, barcode trimming & Demultiplexing...", flush=True)
+                self._run_trim_analysis()
 
-            print("\n>> [4/4] Quality Control: Validating output results...", flush=True)
+            print("\n>> [2/2] Quality Control: Validating output results...", flush=True)
             self.validate_outputs()
             
             print(f"\nRename and trim completed successfully!", flush=True)
-            print(f"Output files for {self.target_species} in: outputs/trim/", flush=True)
+            print(f"Output files for {', '.join(self.target_species)} in: outputs/trim/", flush=True)
             
         except Exception as e:
             print(f"Pipeline failed: {str(e)}", flush=True)
             raise
     
     def _run_trim_analysis(self) -> None:
-        """Run the trim analysis on renamed files."""
+        """Run the trim analysis, renaming reads on the fly."""
         # Initialize trim components with target species filter
         self.barcode_db = BarcodeDatabase(self.barcode_file, self.target_species)
-        self.fastq_processor = FastqProcessor(self.r1_renamed, self.r2_renamed)
-        self.output_manager = OutputManager(self.target_species, self.quality_standard)
+        self.fastq_processor = FastqProcessor(self.r1_file, self.r2_file, rename_dir=self.rename_dir)
+        self.output_manager = OutputManager(self.quality_config, compress=self.compress_output)
         
-        # Load renamed reads
-        self.fastq_processor.load_reads()
+        if self.matcher_engine == "index":
+            # The index must cover the loosest standard among the species
+            self.barcode_matcher = BarcodeIndex(self.barcode_db, max(self.quality_config.values()))
+        elif self.matcher_engine == "numpy":
+            self.barcode_matcher = NumpyBarcodeMatcher(self.barcode_db)
+        else:
+            self.barcode_matcher = ExhaustiveBarcodeMatcher(self.barcode_db)
+        print(f"Barcode matcher: {self.matcher_engine}", flush=True)
+        if self.matcher_engine == "index":
+            self.output_manager.stats.mismatch_cutoff = self.barcode_matcher.mismatch_cutoff
         
-        # Setup output files (only for target species)
+        if self.save_matches:
+            self.match_table = MatchTable()
+        
+        # Setup output files (one pair per target species)
         self.output_manager.open_output_files()
         
         try:
-            # Process all reads for barcode matching
+            # Match and write each batch of pairs as it is read
             self._process_all_reads()
             
-            # Write trimmed results
-            self._write_trimmed_results()
-            
         finally:
             # Clean up
             self.output_manager.close_all_files()
+        
+        if self.match_table is not None:
+            self.match_table.save(self.match_table_path, self._match_table_meta())
     
-    def _process_all_reads(self) -> None:
-        """Process all paired reads for barcode/primer matching."""
-        print("Processing reads for barcode/primer matching...", flush=True)
+    def _match_table_meta(self) -> Dict:
+        """Describe the inputs a match table was computed from."""
+        with open(self.barcode_file, 'rb') as f:
+            barcode_sha1 = hashlib.sha1(f.read()).hexdigest()
+        
+        return {
+            'inputs': [file_fingerprint(self.r1_file), file_fingerprint(self.r2_file)],
+            'barcode_sha1': barcode_sha1,
+            'species': sorted(self.target_species),
+            'locations': list(self.barcode_db.tags.keys()),
+            # The index engine only guarantees the best match up to its mismatch budget
+            'budget': max(self.quality_config.values()) if self.matcher_engine == "index" else None
+        }
+    
+    def _run_retrim(self) -> None:
+        """
+        Rewrite the trim outputs for the current quality config from the
+        matches saved by an earlier --save-matches run. Reads are fetched from
+        mmap offset indexes of R1/R2, and only pairs passing the quality
+        standard are decoded.
+        """
+        if not self.match_table_path.exists():
+            raise ValueError(f"No saved barcode matches found: {self.match_table_path} (run with --save-matches first)")
+        
+        self.barcode_db = BarcodeDatabase(self.barcode_file, self.target_species)
+        table, meta = MatchTable.load(self.match_table_path)
+        print(f"Loaded barcode matches of {len(table)} read pairs: {self.match_table_path}", flush=True)
         
-        total_reads = len(self.fastq_processor.paired_reads)
+        expected = self._match_table_meta()
+        for key in ('inputs', 'barcode_sha1', 'species'):
+            if meta[key] != expected[key]:
+                raise ValueError(f"Saved barcode matches do not belong to the current inputs ({key} differs)")
         
-        for i, (read_index, (r1_record, r2_record)) in enumerate(self.fastq_processor.paired_reads.items()):
-            if i % 10000 == 0:
-                print(f"Processed {i}/{total_reads} reads", flush=True)
-            
-            best_match = self._find_best_barcode_match(r1_record, r2_record)
-            
-            if best_match:
-                location, orientation, mismatch_f, mismatch_r, f_trim_len, r_trim_len = best_match
+        loosest_standard = max(self.quality_config.values())
+        if meta['budget'] is not None and loosest_standard > meta['budget']:
+            raise ValueError(f"Saved barcode matches only cover quality standards up to {meta['budget']} "
+                             f"(requested {loosest_standard})")
+        
+        r1_index = FastqIndex(self.r1_file, self.index_dir)
+        r2_index = FastqIndex(self.r2_file, self.index_dir)
+        if len(r1_index) < len(table) or len(r2_index) < len(table):
+            raise ValueError("FASTQ offset index has fewer records than the saved barcode matches")
+        
+        locations = meta['locations']
+        trim_lens = [tuple(map(len, self.barcode_db.get_combined_tags(location))) for location in locations]
+        
+        self.output_manager = OutputManager(self.quality_config, compress=self.compress_output)
+        self.output_manager.open_output_files()
+        if meta['budget'] is not None:
+            self.output_manager.stats.mismatch_cutoff = 2 * meta['budget'] + 1
+        
+        written_count = 0
+        start_time = time.perf_counter()
+        try:
+            for i in range(len(table)):
+                location_no = table.locations[i]
+                if location_no == -2:
+                    self.output_manager.stats.record_rejected_beyond_cutoff()
+                    continue
+                if location_no < 0:
+                    self.output_manager.stats.record_unmatched()
+                    continue
                 
-                # Store target results
-                species_prefix = location.split('_')[0] if '_' in location else location
-                if species_prefix == self.target_species:
-                    self.results[read_index] = {
-                        'location': location,
-                        'orientation': orientation,
-                        'mismatch_f': mismatch_f,
-                        'mismatch_r': mismatch_r,
-                        'f_trim_len': f_trim_len,
-                        'r_trim_len': r_trim_len
-                    }
-    
-    def _find_best_barcode_match(self, r1_record: FastqRecord, r2_record: FastqRecord) -> Optional[Tuple]:
-        """Find the best barcode match for a read pair."""
-        best_mismatch = float('inf')
-        best_match = None
+                location = locations[location_no]
+                orientation = "R1f" if table.orientations[i] == 0 else "R2f"
+                mismatch_f = table.mismatch_f[i]
+                mismatch_r = table.mismatch_r[i]
+                if not self.output_manager.passes_quality(location, mismatch_f, mismatch_r):
+                    # Rejected pairs are counted without decoding their records
+                    self.output_manager.stats.record_match(location, orientation, mismatch_f, mismatch_r,
+                                                           written=False)
+                    continue
+                
+                f_trim_len, r_trim_len = trim_lens[location_no]
+                success = self.output_manager.write_trimmed_reads(
+                    read_index=str(i),
+                    location=location,
+                    orientation=orientation,
+                    r1_record=r1_index.record(i),
+                    r2_record=r2_index.record(i),
+                    mismatch_f=mismatch_f,
+                    mismatch_r=mismatch_r,
+                    f_trim_len=f_trim_len,
+                    r_trim_len=r_trim_len
+                )
+                
+                if success:
+                    written_count += 1
+        finally:
+            self.output_manager.close_all_files()
+            r1_index.close()
+            r2_index.close()
         
-        # 只在目標物種的條碼中搜尋
-        for location in self.barcode_db.tags.keys():
-            tag_f, tag_r = self.barcode_db.get_combined_tags(location)
-            
-            orientation, mismatch_f, mismatch_r, f_len, r_len = self.matcher.find_best_orientation(
-                tag_f, tag_r, r1_record.sequence, r2_record.sequence
-            )
-            
-            total_mismatch = mismatch_f + mismatch_r
-            
-            if total_mismatch < best_mismatch:
-                best_mismatch = total_mismatch
-                best_match = (location, orientation, mismatch_f, mismatch_r, f_len, r_len)
+        self.processed_count = len(table)
+        self.written_count = written_count
+        self.output_manager.stats.write(self.output_manager.output_dir, self.processed_count,
+                                        time.perf_counter() - start_time)
         
-        return best_match
+        print(f"Re-trimmed {len(table)} read pairs in total", flush=True)
+        for species in self.target_species:
+            print(f"Successfully wrote {self.output_manager.written_counts[species]} trimmed read pairs "
+                  f"for project '{species}'", flush=True)
     
-    def _write_trimmed_results(self) -> None:
-        """Write trimmed reads to output files."""
-        print("Writing trimmed reads to output files...", flush=True)
+    def _process_all_reads(self) -> None:
+        """Stream paired reads, matching barcodes/primers and writing each batch immediately."""
+        print("Processing reads for barcode/primer matching...", flush=True)
         
+        processed_count = 0
         written_count = 0
-        for read_index, result in self.results.items():
-            if read_index in self.fastq_processor.paired_reads:
-                r1_record, r2_record = self.fastq_processor.paired_reads[read_index]
+        location_numbers = {location: i for i, location in enumerate(self.barcode_db.tags.keys())}
+        start_time = time.perf_counter()
+        
+        for batch, matches in self._iter_matched_batches():
+            for (read_index, r1_record, r2_record), best_match in zip(batch, matches):
+                if processed_count % 10000 == 0:
+                    print(f"Processed {processed_count} read pairs", flush=True)
+                processed_count += 1
+                
+                if best_match == REJECTED_MATCH:
+                    self.output_manager.stats.record_rejected_beyond_cutoff()
+                    if self.match_table is not None:
+                        self.match_table.append_rejected()
+                    continue
+                
+                if not best_match:
+                    self.output_manager.stats.record_unmatched()
+                    if self.match_table is not None:
+                        self.match_table.append_unmatched()
+                    continue
+                
+                location, orientation, mismatch_f, mismatch_r, f_trim_len, r_trim_len = best_match
+                
+                if self.match_table is not None:
+                    self.match_table.append(location_numbers[location], orientation, mismatch_f, mismatch_r)
                 
                 success = self.output_manager.write_trimmed_reads(
                     read_index=read_index,
-                    location=result['location'],
-                    orientation=result['orientation'],
+                    location=location,
+                    orientation=orientation,
                     r1_record=r1_record,
                     r2_record=r2_record,
-                    mismatch_f=result['mismatch_f'],
-                    mismatch_r=result['mismatch_r'],
-                    f_trim_len=result['f_trim_len'],
-                    r_trim_len=result['r_trim_len']
+                    mismatch_f=mismatch_f,
+                    mismatch_r=mismatch_r,
+                    f_trim_len=f_trim_len,
+                    r_trim_len=r_trim_len
                 )
                 
                 if success:
                     written_count += 1
         
-        print(f"Successfully wrote {written_count} trimmed read pairs for project '{self.target_species}'", flush=True)
-
+        self.processed_count = processed_count
+        self.written_count = written_count
+        self.output_manager.stats.write(self.output_manager.output_dir, processed_count,
+                                        time.perf_counter() - start_time)
+        
+        print(f"Processed {processed_count} read pairs in total", flush=True)
+        for species in self.target_species:
+            print(f"Successfully wrote {self.output_manager.written_counts[species]} trimmed read pairs "
+                  f"for project '{species}'", flush=True)
+    
+    def _iter_matched_batches(self) -> Iterator[Tuple[List, List[Optional[Tuple]]]]:
+        """
+        Yield (batch, matches) in input order.
+        With more than one worker, batches are matched in a process pool; only
+        the read prefixes are sent, and at most two batches per worker are in
+        flight so memory stays bounded and .f.fq/.r.fq keep the input order.
+        """
+        batches = self.fastq_processor.iter_batches()
+        
+        if self.workers <= 1:
+            for batch in batches:
+                yield batch, self.barcode_matcher.match_batch(
+                    [r1_record.sequence for _, r1_record, _ in batch],
+                    [r2_record.sequence for _, _, r2_record in batch]
+                )
+            return
+        
+        prefix_len = self.barcode_db.max_tag_length()
+        print(f"Matching with {self.workers} worker processes", flush=True)
+        
+        with multiprocessing.Pool(self.workers, initializer=_init_match_worker,
+                                  initargs=(self.barcode_matcher,)) as pool:
+            pending = deque()
+            for batch in batches:
+                job = pool.apply_async(_match_in_worker, (
+                    [r1_record.sequence[:prefix_len] for _, r1_record, _ in batch],
+                    [r2_record.sequence[:prefix_len] for _, _, r2_record in batch]
+                ))
+                pending.append((batch, job))
+                
+                if len(pending) >= 2 * self.workers:
+                    batch, job = pending.popleft()
+                    yield batch, job.get()
+            
+            while pending:
+                batch, job = pending.popleft()
+                yield batch, job.get()
+    
     def validate_outputs(self) -> None:
         """
         Validate that the output files exist and contain enough sequences.
         Simulates the logic of validate_filter_results but for FASTQ files.
+        Sequence counts are taken from the stats sidecars written during the
+        run, so the outputs are not read again. Species with too few sequences
+        are reported; the run fails only when no species has enough.
         """
-        output_dir = Path("/app/data/outputs/trim")
+        valid_species = []
         
-        target_file = output_dir / f"{self.target_species}.f.fq"
-        
-        # Check if the file exists
-        if not target_file.exists():
-            print(f"Validation Error: Output file not found: {target_file}", file=sys.stderr, flush=True)
-            sys.exit(1)
+        for species in self.target_species:
+            target_file = self.output_manager.get_output_path(species, 'f')
             
-        # Count the number of sequences (FASTQ format: every 4 lines is one sequence)
-        line_count = 0
-        try:
-            with open(target_file, 'r', encoding='utf-8') as f:
-                for i, _ in enumerate(f):
-                    line_count = i + 1
-        except Exception as e:
-            print(f"Validation Error: Could not read output file: {e}", file=sys.stderr, flush=True)
-            sys.exit(1)
+            # Check if the file exists
+            if not target_file.exists():
+                print(f"Validation Error: Output file not found: {target_file}", file=sys.stderr, flush=True)
+                sys.exit(1)
+                
+            # Read the number of written sequences from the stats sidecar
+            stats_file = get_stats_path(self.output_manager.output_dir, species)
+            try:
+                with open(stats_file, 'r', encoding='utf-8') as f:
+                    total_sequences = json.load(f)['written_pairs']
+            except Exception as e:
+                print(f"Validation Error: Could not read stats file {stats_file}: {e}", file=sys.stderr, flush=True)
+                sys.exit(1)
+
+            print(f"Validation: Found {total_sequences} sequences in {target_file.name}", flush=True)
 
-        total_sequences = line_count // 4
-        print(f"Validation: Found {total_sequences} sequences in {target_file.name}", flush=True)
+            # Validate the number of sequences (at least 2)
+            if total_sequences < 2:
+                print(f"Validation Warning: Only {total_sequences} sequences remained after trimming "
+                      f"for species '{species}' (require at least 2)", flush=True)
+            else:
+                valid_species.append(species)
 
-        # Validate the number of sequences (at least 2)
-        if total_sequences < 2:
+        if not valid_species:
             error_message = (
-                f"Validation Error: Not enough sequences remained after trimming for species '{self.target_species}' "
-                f"(found {total_sequences}, require at least 2). "
+                f"Validation Error: Not enough sequences remained after trimming for species "
+                f"'{', '.join(self.target_species)}' (require at least 2). "
                 f"This implies either the barcode matching failed or the quality standard is too strict."
             )
             print(error_message, file=sys.stderr, flush=True)
@@ -493,9 +1339,9 @@ def load_quality_config(config_file: str) -> Dict[str, int]:
         
         print(f"Loaded quality configuration: {config_data}", flush=True)
         
-        # 驗證只有一個物種
-        if len(config_data) != 1:
-            raise ValueError(f"Quality config should contain exactly one species, got: {list(config_data.keys())}")
+        # 驗證至少有一個物種
+        if not config_data:
+            raise ValueError("Quality config should contain at least one species")
         
         return config_data
         
@@ -509,28 +1355,49 @@ def load_quality_config(config_file: str) -> Dict[str, int]:
 
 def main():
     """Main function to run the rename and trim."""
-    if len(sys.argv) != 5:
-        print("Usage: python rename_trim.py <R1_fastq> <R2_fastq> <barcode_csv> <quality_config_json>", flush=True)
-        print("Example: python rename_trim.py sample_R1.fastq sample_R2.fastq barcodes.csv quality_config.json", flush=True)
-        print("Note: quality_config.json should contain exactly one species", flush=True)
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Rename and trim paired-end reads by barcode",
+        epilog="Example: python rename_trim.py sample_R1.fastq sample_R2.fastq barcodes.csv quality_config.json. "
+               "Note: quality_config.json maps each species to demultiplex to its maximum mismatch, "
+               "e.g. {\"ZpDL\": 2, \"CypDL\": 1}"
+    )
+    parser.add_argument("r1_file", help="R1 FASTQ file (.fq/.fastq, optionally .gz)")
+    parser.add_argument("r2_file", help="R2 FASTQ file (.fq/.fastq, optionally .gz)")
+    parser.add_argument("barcode_file", help="Barcode CSV file")
+    parser.add_argument("quality_config_file", help="Quality config JSON file")
+    parser.add_argument("--keep-renamed", action="store_true",
+                        help="Also write renamed FASTQ copies to outputs/rename/ (debugging only)")
+    parser.add_argument("--matcher", choices=["index", "numpy", "exhaustive"], default="index",
+                        help="Barcode matching engine (default: index; numpy requires NumPy)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of matching processes (default: 1)")
+    parser.add_argument("--compress-output", action="store_true",
+                        help="Write gzip-compressed .f.fq.gz/.r.fq.gz trim outputs")
+    parser.add_argument("--save-matches", action="store_true",
+                        help="Save the barcode match of every read pair to outputs/fastq_index/ for --retrim")
+    parser.add_argument("--retrim", action="store_true",
+                        help="Rewrite trim outputs for a new quality config from saved matches, "
+                             "without re-reading or re-matching the reads")
+    args = parser.parse_args()
     
-    r1_file = sys.argv[1]
-    r2_file = sys.argv[2]
-    barcode_file = sys.argv[3]
-    quality_config_file = sys.argv[4]
+    if (args.save_matches or args.retrim) and any(f.endswith('.gz') for f in (args.r1_file, args.r2_file)):
+        print("Error: --save-matches and --retrim require uncompressed FASTQ inputs", flush=True)
+        sys.exit(1)
     
     # 檢查檔案是否存在
-    for file_path in [r1_file, r2_file, barcode_file, quality_config_file]:
+    for file_path in [args.r1_file, args.r2_file, args.barcode_file, args.quality_config_file]:
         if not os.path.exists(file_path):
             print(f"Error: File {file_path} not found", flush=True)
             sys.exit(1)
     
     # 載入品質配置
-    quality_config = load_quality_config(quality_config_file)
+    quality_config = load_quality_config(args.quality_config_file)
     
     # 執行分析管道
-    pipeline = IntegratedPipeline(r1_file, r2_file, barcode_file, quality_config)
+    pipeline = IntegratedPipeline(args.r1_file, args.r2_file, args.barcode_file, quality_config,
+                                  keep_renamed=args.keep_renamed, matcher=args.matcher,
+                                  workers=args.workers, compress_output=args.compress_output,
+                                  save_matches=args.save_matches, retrim=args.retrim)
     pipeline.run()
 
 
@@ -3,19 +3,34 @@
 import subprocess
 import os
 import sys
+import errno
+import gzip
+import shutil
+import argparse
+import threading
 # import logging
 from pathlib import Path
 
+# -- shared helpers live in python_scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from seq_stats import count_records, is_fastq
+
+from lenFilter import convert_fq_to_fa_and_filter, get_filter_paths, write_streamed_marker
+from pairMerger import PairMerger
+
 sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 1)
 sys.stderr = os.fdopen(sys.stderr.fileno(), 'w', 1)
 
 class PEARTools:
     """PEAR Tool Wrapper"""
     
-    def __init__(self):
+    def __init__(self, engine="pear"):
         # -- check if running in Docker environment
         self.in_docker = os.path.exists("/app") and os.path.exists("/.dockerenv")
         
+        # -- "pear" runs the PEAR binary, "numpy" the in-process merger (pairMerger.py)
+        self.engine = engine
+        
         self.trim_output_dir = "/app/data/outputs/trim"
         self.pear_output_dir = "/app/data/outputs/pear"
     
@@ -38,54 +53,166 @@ class PEARTools:
             print(f"Error: {e.stderr}", flush=True)
             raise
     
-    def pear_join(self, forward_file, reverse_file, output_prefix, threads=4):
+    def pear_join(self, forward_file, reverse_file, output_prefix, threads=4, stream_filter=None):
         """
         Args:
             forward_file: R1 file path (*.f.fq)
             reverse_file: R2 file path (*.r.fq)
             output_prefix: Output file prefix
             threads: Number of threads 
+            stream_filter: Optional (min_length, max_length, max_ee); the assembled reads are then
+                           length-filtered while PEAR runs instead of being written to disk
         """
+        if self.engine == "numpy":
+            return self.numpy_join(forward_file, reverse_file, output_prefix)
+        
         if not self.in_docker:
-            self.logger.warning("PEAR can only be executed within Docker container")
             print("Warning: PEAR can only be executed within Docker container", flush=True)
             return None
         
+        # -- PEAR is given plain FASTQ; .gz trim outputs are decompressed next to its outputs
+        temp_files = []
+        forward_input = self.decompress_input(forward_file, output_prefix, temp_files)
+        reverse_input = self.decompress_input(reverse_file, output_prefix, temp_files)
+        
         cmd = [
             'pear',
-            '-f', str(forward_file),
-            '-r', str(reverse_file),
+            '-f', str(forward_input),
+            '-r', str(reverse_input),
             '-o', str(output_prefix),
             '-j', str(threads)
         ]
         
-        self.run_command(cmd)
+        try:
+            if stream_filter:
+                self.run_pear_streaming(cmd, output_prefix, *stream_filter)
+            else:
+                self.run_command(cmd)
+        finally:
+            for temp_file in temp_files:
+                os.remove(temp_file)
         
         # -- return expected output files
+        outputs = {
+            'assembled': f"{output_prefix}.assembled.fastq",
+            'unassembled_forward': f"{output_prefix}.unassembled.forward.fastq", 
+            'unassembled_reverse': f"{output_prefix}.unassembled.reverse.fastq",
+            'discarded': f"{output_prefix}.discarded.fastq"
+        }
+        if stream_filter:
+            # -- assembled reads went straight to the length filter
+            del outputs['assembled']
+        return outputs
+
+    def numpy_join(self, forward_file, reverse_file, output_prefix):
+        """Merge with the in-process NumPy merger, writing the same files as PEAR"""
+        print(f"Merging {Path(forward_file).name} and {Path(reverse_file).name} in-process (numpy engine)", flush=True)
+        counts = PairMerger().merge_files(forward_file, reverse_file, output_prefix)
+        print(f"  assembled {counts['assembled']}, unassembled {counts['unassembled']}, "
+              f"discarded {counts['discarded']} pairs", flush=True)
+        
         return {
             'assembled': f"{output_prefix}.assembled.fastq",
             'unassembled_forward': f"{output_prefix}.unassembled.forward.fastq", 
             'unassembled_reverse': f"{output_prefix}.unassembled.reverse.fastq",
             'discarded': f"{output_prefix}.discarded.fastq"
         }
+    
+    def run_pear_streaming(self, cmd, output_prefix, min_length, max_length=None, max_ee=None):
+        """
+        Run PEAR with its assembled output replaced by a named pipe, which the
+        length filter reads while PEAR is still merging
+        """
+        sample_name = Path(output_prefix).name
+        fifo_path = f"{output_prefix}.assembled.fastq"
+        output_path, delete_seq_file = get_filter_paths(sample_name)
+        
+        if os.path.exists(fifo_path):
+            os.remove(fifo_path)
+        os.mkfifo(fifo_path)
+        
+        counts = {}
+        errors = []
+        
+        def consume():
+            try:
+                counts['kept'], counts['removed'], counts['removed_ee'] = convert_fq_to_fa_and_filter(
+                    fifo_path, output_path, delete_seq_file, min_length, max_length, max_ee)
+            except Exception as e:
+                errors.append(e)
+        
+        def close_writer():
+            # -- opening and closing the write end gives a waiting consumer EOF; the open
+            # -- fails with ENXIO until the consumer has the read end, and the loop ends
+            # -- if the consumer exits without ever opening it
+            while consumer.is_alive():
+                try:
+                    os.close(os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK))
+                    return
+                except OSError as e:
+                    if e.errno != errno.ENXIO:
+                        raise
+                consumer.join(0.05)
+        
+        consumer = threading.Thread(target=consume, daemon=True)
+        
+        try:
+            print(f"Executing: {' '.join(cmd)} (assembled reads streamed to the length filter)", flush=True)
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            consumer.start()
+            stdout, stderr = process.communicate()
+            
+            # -- PEAR may have exited without ever opening the pipe (e.g. on an error)
+            close_writer()
+            consumer.join()
+            
+            if process.returncode != 0:
+                print(f"Command failed: {' '.join(cmd)}", flush=True)
+                print(f"Error: {stderr}", flush=True)
+                raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+        finally:
+            # -- a leftover FIFO would block every later listing that opens it
+            if os.path.exists(fifo_path):
+                os.remove(fifo_path)
+        
+        if errors:
+            raise errors[0]
+        
+        print(f"{sample_name}: kept {counts['kept']} sequences, removed {counts['removed']} by length, "
+              f"{counts['removed_ee']} by expected errors", flush=True)
+        write_streamed_marker(self.pear_output_dir, sample_name, counts['kept'], counts['removed'],
+                              counts['removed_ee'], min_length, max_length, max_ee)
+    
+    def decompress_input(self, fastq_file, output_prefix, temp_files):
+        """Return a plain FASTQ path for PEAR, decompressing .gz input to a temporary file"""
+        if not str(fastq_file).endswith('.gz'):
+            return fastq_file
+        
+        plain_file = str(Path(output_prefix).parent / Path(str(fastq_file)[:-3]).name)
+        print(f"Decompressing {Path(fastq_file).name} for PEAR", flush=True)
+        with gzip.open(fastq_file, 'rb') as f_in, open(plain_file, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out, 1 << 20)
+        temp_files.append(plain_file)
+        return plain_file
 
-def run_pear_analysis():
-    tools = PEARTools()
+def run_pear_analysis(stream_filter=None, engine="pear"):
+    tools = PEARTools(engine)
     
     print("=" * 40, flush=True)
     print("PEAR v0.9.6 [January 15, 2015]", flush=True)
     
     print(f"\nPEAR output directory: {tools.pear_output_dir}", flush=True)
     
-    # -- find all .f.fq and .r.fq files
+    # -- find all .f.fq and .r.fq files (optionally gzip-compressed)
     species_files = []
     trim_path = Path(tools.trim_output_dir)
     
     print(f"Scanning trim output directory: {tools.trim_output_dir}", flush=True)
     
-    for f_file in trim_path.glob("*.f.fq"):
-        species_name = f_file.stem.replace('.f', '')
-        r_file = f_file.parent / f"{species_name}.r.fq"
+    for f_file in sorted(list(trim_path.glob("*.f.fq")) + list(trim_path.glob("*.f.fq.gz"))):
+        suffix = ".fq.gz" if f_file.name.endswith(".gz") else ".fq"
+        species_name = f_file.name[:-len(".f" + suffix)]
+        r_file = f_file.parent / f"{species_name}.r{suffix}"
         
         if r_file.exists():
             species_files.append({
@@ -96,13 +223,8 @@ def run_pear_analysis():
             
             # -- check file size and sequence count
             try:
-                with open(f_file, 'r') as f:
-                    f_lines = sum(1 for line in f)
-                with open(r_file, 'r') as f:
-                    r_lines = sum(1 for line in f)
-                
-                f_seqs = f_lines // 4
-                r_seqs = r_lines // 4
+                f_seqs = count_records(f_file)
+                r_seqs = count_records(r_file)
                 
                 print(f"Found project: {species_name}", flush=True)
                 print(f"  Forward: {f_file.name} ({f_seqs} sequences)", flush=True)
@@ -133,7 +255,8 @@ def run_pear_analysis():
             pear_results = tools.pear_join(
                 forward_file=species_data['forward'],
                 reverse_file=species_data['reverse'],
-                output_prefix=output_prefix
+                output_prefix=output_prefix,
+                stream_filter=stream_filter
             )
             
             if pear_results:
@@ -144,12 +267,8 @@ def run_pear_analysis():
                     filepath = Path(filename)
                     if filepath.exists():
                         # 計算序列數量
-                        seq_count = 0
                         try:
-                            with open(filepath, 'r') as f:
-                                for line_num, line in enumerate(f):
-                                    if line_num % 4 == 0:  # FASTQ header
-                                        seq_count += 1
+                            seq_count = count_records(filepath)
                         except:
                             seq_count = "unknown"
                         
@@ -179,7 +298,8 @@ def list_available_files():
         if files:
             for file in files:
                 size = file.stat().st_size if file.exists() else 0
-                print(f"  {file.name} ({size} bytes)", flush=True)
+                seq_info = f", {count_records(file)} sequences" if is_fastq(file) else ""
+                print(f"  {file.name} ({size} bytes{seq_info})", flush=True)
         else:
             print("  (empty directory)", flush=True)
     else:
@@ -193,16 +313,38 @@ def list_available_files():
         if files:
             for file in files:
                 size = file.stat().st_size if file.exists() else 0
-                print(f"  {file.name} ({size} bytes)", flush=True)
+                seq_info = f", {count_records(file)} sequences" if is_fastq(file) else ""
+                print(f"  {file.name} ({size} bytes{seq_info})", flush=True)
         else:
             print("  (empty directory)", flush=True)
     else:
         print(f"PEAR output directory: {pear_dir} (will be created)", flush=True)
 
 def main():
+    parser = argparse.ArgumentParser(description="Merge trimmed paired-end reads with PEAR")
+    parser.add_argument("--stream-filter", nargs='+', type=int, metavar="LENGTH",
+                        help="MIN_LENGTH [MAX_LENGTH]: length-filter the assembled reads while PEAR runs, "
+                             "without writing *.assembled.fastq")
+    parser.add_argument("--max-ee", type=float,
+                        help="With --stream-filter, also discard reads whose expected errors exceed this value")
+    parser.add_argument("--engine", choices=["pear", "numpy"], default="pear",
+                        help="Merge engine (default: pear; numpy is an in-process merger for small runs)")
+    args = parser.parse_args()
+    
+    if args.stream_filter and args.engine != "pear":
+        parser.error("--stream-filter is only supported with the pear engine")
+    
+    stream_filter = None
+    if args.stream_filter:
+        if len(args.stream_filter) > 2:
+            parser.error("--stream-filter takes MIN_LENGTH and an optional MAX_LENGTH")
+        min_length = args.stream_filter[0]
+        max_length = args.stream_filter[1] if len(args.stream_filter) > 1 else None
+        stream_filter = (min_length, max_length, args.max_ee)
+    
     list_available_files()
     print(flush=True)
-    results = run_pear_analysis()
+    results = run_pear_analysis(stream_filter, args.engine)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
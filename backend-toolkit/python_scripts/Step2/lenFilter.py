@@ -1,21 +1,85 @@
 import os
 import glob
+import json
 import sys
+import argparse
+import multiprocessing
+from pathlib import Path
+
+# -- shared helpers live in python_scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from seq_io import open_sequence_file, WRITE_BUFFER_SIZE
+
+try:
+    import numpy as np
+except ImportError: # -- the expected-error filter falls back to pure Python
+    np = None
+
+EE_BATCH_SIZE = 10000
+
+# -- error probability 10^(-Q/10) of every Phred+33 quality character
+_ERROR_PROBABILITIES = [10 ** (-max(code - 33, 0) / 10) for code in range(256)]
+EE_TABLE = np.array(_ERROR_PROBABILITIES) if np is not None else _ERROR_PROBABILITIES
+
+FILTER_DIR = "/app/data/outputs/filter"
+FILTER_DEL_DIR = "/app/data/outputs/filter_del"
+STREAMED_SUFFIX = ".streamed.json" # -- written next to PEAR outputs when joinPear filtered while merging
+
+
+def get_filter_paths(sample_name):
+    """Return (kept FASTA, removed FASTA) paths of a sample, creating the directories"""
+    os.makedirs(FILTER_DIR, exist_ok = True) # -- if the file "output_dir" is empty, create
+    os.makedirs(FILTER_DEL_DIR, exist_ok = True)
+
+    output_path = os.path.join(FILTER_DIR, f"{sample_name}.assembled.len.fasta")
+    delete_seq_file = os.path.join(FILTER_DEL_DIR, f"{sample_name}.assembled.del.fasta")
+    return output_path, delete_seq_file
+
+
+def write_streamed_marker(directory, sample_name, kept, removed, removed_ee, min_length, max_length, max_ee):
+    """Record that a sample was already filtered while PEAR was running"""
+    marker = os.path.join(directory, f"{sample_name}{STREAMED_SUFFIX}")
+    with open(marker, 'w') as f:
+        json.dump({'kept': kept, 'removed': removed, 'removed_ee': removed_ee,
+                   'min_length': min_length, 'max_length': max_length, 'max_ee': max_ee}, f)
+
+
+def process_streamed_samples(min_length, max_length = None, max_ee = None, directory = "/app/data/outputs/pear"):
+    """Return {sample_name: kept sequences} of samples filtered while PEAR was running"""
+    kept_counts = {}
+
+    for marker in sorted(glob.glob(os.path.join(directory, f"*{STREAMED_SUFFIX}"))):
+        sample_name = os.path.basename(marker)[:-len(STREAMED_SUFFIX)]
+        with open(marker, 'r') as f:
+            streamed = json.load(f)
+
+        # -- the assembled reads were never written to disk, so they cannot be filtered again
+        settings = (min_length, max_length, max_ee)
+        streamed_settings = (streamed['min_length'], streamed['max_length'], streamed.get('max_ee'))
+        if streamed_settings != settings:
+            print(f"Validation Error: {sample_name} was filtered during PEAR with min length/max length/max expected errors "
+                  f"{'/'.join(map(str, streamed_settings))}, not {'/'.join(map(str, settings))}",
+                  file=sys.stderr, flush=True)
+            sys.exit(1)
+
+        print(f"{sample_name}: already filtered during PEAR (kept {streamed['kept']} sequences, "
+              f"removed {streamed['removed']} by length, {streamed.get('removed_ee', 0)} by expected errors)", flush=True)
+        kept_counts[sample_name] = streamed['kept']
+
+    return kept_counts
 
-sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 1)
-sys.stderr = os.fdopen(sys.stderr.fileno(), 'w', 1)
 
 def process_assembled_fastq(directory = "/app/data/outputs/pear"):
     assembled_files = {}
 
     pattern = os.path.join(directory, '*.assembled.fastq') # -- output/pear_output/*.assembled.fastq
-    files = glob.glob(pattern) # -- ['xxx.assembled.fastq', 'yyy.assembled.fastq', 'zzz.assembled.fastq']
+    files = glob.glob(pattern) + glob.glob(pattern + '.gz') # -- ['xxx.assembled.fastq', 'yyy.assembled.fastq.gz', ...]
     print(pattern)
     print(files)
 
     for file_path in files:
         filename = os.path.basename(file_path)
-        sample_name = filename.replace('.assembled.fastq', '')
+        sample_name = filename.replace('.assembled.fastq', '').replace('.gz', '')
 
         assembled_files[sample_name] = file_path
         print(f"Find the archive: {sample_name} -> {file_path}", flush=True)
@@ -23,70 +87,149 @@ def process_assembled_fastq(directory = "/app/data/outputs/pear"):
     return assembled_files
 
 
-def convert_fq_to_fa_and_filter(fastq_file, output_file, delete_seq_file, min_length = 200, max_length = None):
-    with open(fastq_file, 'r') as f_in, open(output_file, 'w') as f_out, open(delete_seq_file, 'w') as f_del:
-        lines = f_in.readlines()
-        for i in range(0, len(lines), 4):
-            header = lines[i].strip().replace('@', '>', 1)
-            sequence = lines[i+1].strip()
-
-            min_check = len(sequence) >= min_length
-            max_check = (max_length is None) or (len(sequence) <= max_length)
-
-            if min_check and max_check:
-                f_out.write(f"{header}\n{sequence}\n")
-            else:
-                f_del.write(f"{header}\n{sequence}\n")
-
-
-def filter_and_convert(assembled_files, min_length, max_length = None):
-    output_dir = "/app/data/outputs/filter"
-    os.makedirs(output_dir, exist_ok = True) # -- if the file "output_dir" is empty, create
-
-    delete_dir = "/app/data/outputs/filter_del"
-    os.makedirs(delete_dir, exist_ok = True)
-
+def iter_fastq_records(f_in):
+    """Yield (header, sequence, quality) for each 4-line FASTQ record, stopping at a truncated trailing record"""
+    while True:
+        header = f_in.readline()
+        sequence = f_in.readline()
+        f_in.readline() # -- '+' separator
+        quality = f_in.readline()
+
+        if not quality:
+            break
+
+        yield header.strip(), sequence.strip(), quality.strip()
+
+
+def iter_batches(records, batch_size = EE_BATCH_SIZE):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def expected_errors(qualities):
+    """Expected number of errors (sum of 10^(-Q/10)) of each Phred+33 quality string"""
+    if np is None:
+        return [sum(EE_TABLE[code] for code in quality.encode('latin-1')) for quality in qualities]
+
+    # -- one lookup over all quality strings, then each read summed on its own, so that
+    # -- its value never depends on the other reads of the batch
+    codes = np.frombuffer(''.join(qualities).encode('latin-1'), dtype=np.uint8)
+    lengths = np.array([len(quality) for quality in qualities], dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    errors = np.zeros(len(qualities))
+    nonempty = lengths > 0
+    if nonempty.any():
+        # -- reduceat would return the next read's first value for an empty one
+        errors[nonempty] = np.add.reduceat(EE_TABLE[codes], starts[nonempty])
+    return errors.tolist()
+
+
+def convert_fq_to_fa_and_filter(fastq_file, output_file, delete_seq_file, min_length = 200, max_length = None, max_ee = None):
+    """Returns (kept, removed by length, removed by expected errors)"""
+    kept = 0
+    removed = 0
+    removed_ee = 0
+
+    # -- large write buffers, the outputs are written sequentially
+    with open_sequence_file(fastq_file) as f_in, \
+            open(output_file, 'w', buffering = WRITE_BUFFER_SIZE) as f_out, \
+            open(delete_seq_file, 'w', buffering = WRITE_BUFFER_SIZE) as f_del:
+        for batch in iter_batches(iter_fastq_records(f_in)):
+            errors = expected_errors([quality for _, _, quality in batch]) if max_ee is not None else None
+
+            for i, (header, sequence, _) in enumerate(batch):
+                header = header.replace('@', '>', 1)
+
+                min_check = len(sequence) >= min_length
+                max_check = (max_length is None) or (len(sequence) <= max_length)
+
+                if not (min_check and max_check):
+                    f_del.write(f"{header}\n{sequence}\n")
+                    removed += 1
+                elif errors is not None and errors[i] > max_ee:
+                    f_del.write(f"{header}\n{sequence}\n")
+                    removed_ee += 1
+                else:
+                    f_out.write(f"{header}\n{sequence}\n")
+                    kept += 1
+
+    return kept, removed, removed_ee
+
+
+def _filter_sample(args):
+    sample_name, fastq_file, output_path, delete_seq_file, min_length, max_length, max_ee = args
+    kept, removed, removed_ee = convert_fq_to_fa_and_filter(fastq_file, output_path, delete_seq_file,
+                                                            min_length, max_length, max_ee)
+    return sample_name, kept, removed, removed_ee
+
+
+def filter_and_convert(assembled_files, min_length, max_length = None, max_ee = None, workers = None):
+    """Filter every assembled file, in parallel across samples; returns {sample_name: kept sequences}"""
     if not assembled_files:
-        return
+        return {}
 
+    jobs = []
     for sample_name, fastq_file in assembled_files.items():
-        output_path = os.path.join(output_dir, f"{sample_name}.assembled.len.fasta")
-        delete_seq_file = os.path.join(delete_dir, f"{sample_name}.assembled.del.fasta")
+        output_path, delete_seq_file = get_filter_paths(sample_name)
         print(output_path, flush=True)
-        convert_fq_to_fa_and_filter(fastq_file, output_path, delete_seq_file, min_length, max_length)
+        jobs.append((sample_name, fastq_file, output_path, delete_seq_file, min_length, max_length, max_ee))
+
+    if workers is None:
+        workers = min(len(jobs), os.cpu_count() or 1)
 
+    if workers <= 1:
+        results = [_filter_sample(job) for job in jobs]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.map(_filter_sample, jobs)
 
-def validate_filter_results(directory = "/app/data/outputs/filter"):
-    total_sequences = 0
+    kept_counts = {}
+    for sample_name, kept, removed, removed_ee in results:
+        print(f"{sample_name}: kept {kept} sequences, removed {removed} by length, "
+              f"{removed_ee} by expected errors", flush=True)
+        kept_counts[sample_name] = kept
 
-    pattern = os.path.join(directory, '*.fasta')
-    files = glob.glob(pattern)
+    return kept_counts
 
-    if not files:
-        print(f"Validation Error: No FASTA files found in {directory}", flush=True)
+
+def validate_filter_results(kept_counts):
+    if not kept_counts:
+        print(f"Validation Error: No FASTA files found in {FILTER_DIR}", flush=True)
         sys.exit(1)
 
-    for file_path in files:
-        with open(file_path, 'r') as f:
-            for line in f:
-                if line.startswith('>'):
-                    total_sequences += 1
+    # -- counts come from the filter itself, the outputs are not read again
+    total_sequences = sum(kept_counts.values())
 
     if total_sequences < 2:
-        error_message = f"Validation Error: Not enough sequences remained after filtering (found {total_sequences}, require at least 2). This wll cause downstream alignment to fail. Please adjust your min/max length settings."
+        error_message = f"Validation Error: Not enough sequences remained after filtering (found {total_sequences}, require at least 2). This wll cause downstream alignment to fail. Please adjust your min/max length or maximum expected error settings."
         print(error_message, file=sys.stderr, flush=True)
         sys.exit(1)
 
 
 if __name__ == "__main__":
-    min_length = int(sys.argv[1])
-    max_length = None
+    sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 1)
+    sys.stderr = os.fdopen(sys.stderr.fileno(), 'w', 1)
+
+    parser = argparse.ArgumentParser(description="Length and expected-error filter of assembled reads")
+    parser.add_argument("min_length", type=int)
+    parser.add_argument("max_length", type=int, nargs='?')
+    parser.add_argument("--max-ee", type=float,
+                        help="Discard reads whose expected errors (sum of 10^(-Q/10)) exceed this value")
+    args = parser.parse_args()
 
-    if len(sys.argv) > 2 and sys.argv[2]:
-        max_length = int(sys.argv[2])
+    min_length = args.min_length
+    max_length = args.max_length
+    max_ee = args.max_ee
 
     assembled_files = process_assembled_fastq()
-    filter_and_convert(assembled_files, min_length, max_length)
+    kept_counts = filter_and_convert(assembled_files, min_length, max_length, max_ee)
+    kept_counts.update(process_streamed_samples(min_length, max_length, max_ee))
 
     # validate filter results
-    validate_filter_results()
+    validate_filter_results(kept_counts)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+"""
+In-process paired-end merger
+A fast path for small runs that avoids PEAR's container and start-up cost.
+The forward read is overlapped with the reverse complement of the reverse
+read; every candidate overlap length is scored for a whole batch of pairs at
+once with NumPy, and the best one passing the mismatch limit is merged by
+taking the higher-quality base at each overlapping position; where the reads
+disagree its quality drops to the difference of the two qualities.
+
+Like PEAR, staggered pairs are assembled too: when the amplicon is shorter
+than the reads, the reverse read starts before the forward read and both run
+on into adapter sequence; only the overlapping region, the amplicon, is kept.
+Pairs where one read lies strictly inside the other are left unassembled.
+
+Outputs the same files as PEAR:
+  <prefix>.assembled.fastq, <prefix>.unassembled.forward.fastq,
+  <prefix>.unassembled.reverse.fastq, <prefix>.discarded.fastq
+
+Usage: python pairMerger.py <forward_fq> <reverse_fq> <output_prefix>
+       python pairMerger.py --benchmark <forward_fq> <reverse_fq>
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+# -- shared helpers live in python_scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from seq_io import open_sequence_file, reverse_complement, WRITE_BUFFER_SIZE
+
+try:
+    import numpy as np
+except ImportError:  # only needed for the numpy merge engine
+    np = None
+
+N_CODE = ord('N')
+PHRED_OFFSET = 33
+MIN_MISMATCH_QUALITY = 2
+
+
+def iter_fastq_pairs(forward_file, reverse_file):
+    """Yield ((header, sequence, quality), (header, sequence, quality)) of both files in lockstep"""
+    with open_sequence_file(forward_file) as f_in, open_sequence_file(reverse_file) as r_in:
+        while True:
+            records = []
+            for handle in (f_in, r_in):
+                header = handle.readline()
+                sequence = handle.readline()
+                handle.readline() # -- '+' separator
+                quality = handle.readline()
+                records.append((header.rstrip(), sequence.strip(), quality.strip()) if quality else None)
+
+            # -- stop at EOF or on a truncated trailing record
+            if None in records:
+                break
+
+            yield records[0], records[1]
+
+
+class PairMerger:
+    """NumPy paired-end merger"""
+
+    def __init__(self, min_overlap=10, max_mismatch_rate=0.1, batch_size=5000):
+        """
+        Args:
+            min_overlap: Minimum overlap length between the reads
+            max_mismatch_rate: Maximum fraction of mismatching bases in the overlap
+            batch_size: Number of pairs scored together
+        """
+        if np is None:
+            raise ImportError("The numpy merge engine requires NumPy to be installed")
+
+        self.min_overlap = min_overlap
+        self.max_mismatch_rate = max_mismatch_rate
+        self.batch_size = batch_size
+
+    def _encode(self, sequences, right_align=False):
+        """Encode upper-cased sequences as a zero-padded uint8 matrix plus lengths"""
+        width = max(map(len, sequences), default=0)
+        pad = bytes.rjust if right_align else bytes.ljust
+        buffer = b''.join(pad(seq.upper().encode('latin-1'), width, b'\0') for seq in sequences)
+        encoded = np.frombuffer(buffer, dtype=np.uint8).reshape(len(sequences), width)
+        lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+        return encoded, lengths
+
+    def best_overlaps(self, forward_seqs, rc_seqs):
+        """
+        Return the chosen overlap of each pair: its length, negated for a
+        staggered overlap, or 0 when none passes. A regular overlap is the
+        suffix of the forward read against the prefix of the reverse-complemented
+        reverse read, a staggered one the prefix of the forward read against the
+        suffix of the reverse complement; longer overlaps with few mismatches win.
+        """
+        # -- right-aligned copies make suffixes plain column slices, left-aligned ones prefixes
+        forward_right, f_lens = self._encode(forward_seqs, right_align=True)
+        forward_left, _ = self._encode(forward_seqs)
+        rc_left, r_lens = self._encode(rc_seqs)
+        rc_right, _ = self._encode(rc_seqs, right_align=True)
+        f_width = forward_right.shape[1]
+        r_width = rc_right.shape[1]
+
+        best_overlap = np.zeros(len(forward_seqs), dtype=np.int64)
+        best_score = np.full(len(forward_seqs), -1, dtype=np.int64)
+        max_overlap = int(min(f_lens.max(initial=0), r_lens.max(initial=0)))
+
+        for overlap in range(self.min_overlap, max_overlap + 1):
+            fits = (f_lens >= overlap) & (r_lens >= overlap)
+            if not fits.any():
+                continue
+
+            # -- regular first, so that a full overlap of equal-length reads is never called staggered
+            for sign, f_part, r_part in ((1, forward_right[:, f_width - overlap:], rc_left[:, :overlap]),
+                                         (-1, forward_left[:, :overlap], rc_right[:, r_width - overlap:])):
+                mismatches = ((f_part != r_part) | (f_part == N_CODE)).sum(axis=1)
+                score = overlap - 3 * mismatches
+                better = fits & (mismatches <= self.max_mismatch_rate * overlap) & (score > best_score)
+
+                best_score[better] = score[better]
+                best_overlap[better] = sign * overlap
+
+        return best_overlap
+
+    def merge_pair(self, forward, rc_seq, rc_qual, overlap):
+        """
+        Merge one pair given its overlap from best_overlaps, keeping the
+        higher-quality base in the overlap; a staggered pair merges to the
+        overlap alone, dropping the adapter overhang of both reads
+        """
+        _, f_seq, f_qual = forward
+        if overlap < 0:
+            overlap = -overlap
+            f_seq, f_qual = f_seq[:overlap], f_qual[:overlap]
+            rc_seq, rc_qual = rc_seq[len(rc_seq) - overlap:], rc_qual[len(rc_qual) - overlap:]
+        start = len(f_seq) - overlap
+
+        f_bases = np.frombuffer(f_seq[start:].encode('latin-1'), dtype=np.uint8)
+        f_quals = np.frombuffer(f_qual[start:].encode('latin-1'), dtype=np.uint8)
+        r_bases = np.frombuffer(rc_seq[:overlap].encode('latin-1'), dtype=np.uint8)
+        r_quals = np.frombuffer(rc_qual[:overlap].encode('latin-1'), dtype=np.uint8)
+
+        take_reverse = r_quals > f_quals
+        bases = np.where(take_reverse, r_bases, f_bases).tobytes().decode('latin-1')
+
+        # -- agreeing bases keep the better quality; at a mismatch the chosen base is only as
+        # -- certain as its margin over the other one (Phred difference, at least Q2), like FLASH
+        margin = np.abs(f_quals.astype(np.int16) - r_quals.astype(np.int16))
+        mismatch_quals = (PHRED_OFFSET + np.maximum(margin, MIN_MISMATCH_QUALITY)).astype(np.uint8)
+        quals = np.where(f_bases == r_bases, np.maximum(f_quals, r_quals), mismatch_quals)
+        quals = quals.tobytes().decode('latin-1')
+
+        return (f_seq[:start] + bases + rc_seq[overlap:],
+                f_qual[:start] + quals + rc_qual[overlap:])
+
+    def merge_files(self, forward_file, reverse_file, output_prefix):
+        """
+        Args:
+            forward_file: Forward reads (*.f.fq)
+            reverse_file: Reverse reads (*.r.fq)
+            output_prefix: Output file prefix
+        Returns counts of assembled, unassembled and discarded pairs
+        """
+        counts = {'assembled': 0, 'unassembled': 0, 'discarded': 0}
+        outputs = {
+            name: open(f"{output_prefix}.{name}.fastq", 'w', buffering=WRITE_BUFFER_SIZE)
+            for name in ('assembled', 'unassembled.forward', 'unassembled.reverse', 'discarded')
+        }
+
+        try:
+            batch = []
+            for pair in iter_fastq_pairs(forward_file, reverse_file):
+                batch.append(pair)
+                if len(batch) >= self.batch_size:
+                    self._merge_batch(batch, outputs, counts)
+                    batch = []
+            if batch:
+                self._merge_batch(batch, outputs, counts)
+        finally:
+            for handle in outputs.values():
+                handle.close()
+
+        return counts
+
+    def _merge_batch(self, batch, outputs, counts):
+        # -- pairs with an empty read cannot be merged; like PEAR, the forward read is kept
+        usable = [(forward, reverse) for forward, reverse in batch if forward[1] and reverse[1]]
+        for forward, reverse in batch:
+            if not (forward[1] and reverse[1]):
+                outputs['discarded'].write("%s\n%s\n+\n%s\n" % forward)
+                counts['discarded'] += 1
+
+        if not usable:
+            return
+
+        rc_seqs = [reverse_complement(reverse[1]) for _, reverse in usable]
+        overlaps = self.best_overlaps([forward[1] for forward, _ in usable], rc_seqs)
+
+        for (forward, reverse), rc_seq, overlap in zip(usable, rc_seqs, overlaps.tolist()):
+            if overlap == 0:
+                outputs['unassembled.forward'].write("%s\n%s\n+\n%s\n" % forward)
+                outputs['unassembled.reverse'].write("%s\n%s\n+\n%s\n" % reverse)
+                counts['unassembled'] += 1
+                continue
+
+            sequence, quality = self.merge_pair(forward, rc_seq, reverse[2][::-1], overlap)
+            outputs['assembled'].write(f"{forward[0]}\n{sequence}\n+\n{quality}\n")
+            counts['assembled'] += 1
+
+
+def benchmark(forward_file, reverse_file, threads=4):
+    """Time the numpy merger against PEAR (when installed) on the same pairs"""
+    pairs = sum(1 for _ in iter_fastq_pairs(forward_file, reverse_file))
+    print(f"Benchmark input: {pairs} pairs", flush=True)
+
+    work_dir = tempfile.mkdtemp(prefix="merge_benchmark_")
+    try:
+        start = time.perf_counter()
+        counts = PairMerger().merge_files(forward_file, reverse_file, os.path.join(work_dir, "numpy"))
+        elapsed = time.perf_counter() - start
+        print(f"numpy: {elapsed:.2f} s, {pairs / elapsed:.0f} pairs/s "
+              f"(assembled {counts['assembled']}, unassembled {counts['unassembled']}, "
+              f"discarded {counts['discarded']})", flush=True)
+
+        if shutil.which('pear') is None:
+            print("pear: not installed, skipped", flush=True)
+            return
+
+        start = time.perf_counter()
+        subprocess.run(['pear', '-f', str(forward_file), '-r', str(reverse_file),
+                        '-o', os.path.join(work_dir, "pear"), '-j', str(threads)],
+                       capture_output=True, text=True, check=True)
+        elapsed = time.perf_counter() - start
+        with open(os.path.join(work_dir, "pear.assembled.fastq")) as f:
+            assembled = sum(1 for _ in f) // 4
+        print(f"pear: {elapsed:.2f} s, {pairs / elapsed:.0f} pairs/s (assembled {assembled})", flush=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 1)
+    sys.stderr = os.fdopen(sys.stderr.fileno(), 'w', 1)
+
+    parser = argparse.ArgumentParser(description="Merge paired-end reads in-process with NumPy")
+    parser.add_argument("--benchmark", action="store_true", help="Compare throughput with PEAR")
+    parser.add_argument("forward_file")
+    parser.add_argument("reverse_file")
+    parser.add_argument("output_prefix", nargs='?')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.forward_file, args.reverse_file)
+    elif args.output_prefix:
+        counts = PairMerger().merge_files(args.forward_file, args.reverse_file, args.output_prefix)
+        print(counts, flush=True)
+    else:
+        parser.error("output_prefix is required unless --benchmark is given")
@@ -10,26 +10,179 @@ Modified species assignment script:
 import sys
 import os
 import re
+import multiprocessing
 from pathlib import Path
 
-def species_assignment(keyword, identity_threshold):
-    # -- Find the dloop.bln file in the blast output directory
+SPECIES_PATTERN = re.compile(r'[A-Z][a-z]+-[a-z]+')
+
+# -- subject table of the reference, copied next to the BLAST results by joinBlast.py
+SUBJECT_TABLE = Path("/app/data/outputs/blast/reference.subjects.tsv")
+
+def extract_species_name(species):
+    """Genus-species part of a sanitized subject id, e.g. ..._Zacco-platypus_... -> Zacco-platypus"""
+    match = SPECIES_PATTERN.search(species)
+    if match:
+        return match.group(0)
+    return species.split('-')[0] if '-' in species else species
+
+class SubjectTable:
+    """
+    Species name and '_'-separated tokens of each reference subject id, read
+    from the table built with the BLAST database; subjects missing from it
+    are parsed once on first use
+    """
+    
+    def __init__(self, table_file=SUBJECT_TABLE):
+        self.subjects = {}
+        if not Path(table_file).exists():
+            print(f"No subject table found at {table_file}, parsing subject ids on demand", flush=True)
+            return
+        
+        with open(table_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('#'):
+                    continue
+                subject_id, species_name, _ = line.rstrip('\n').split('\t', 2)
+                self.subjects[subject_id] = (species_name, frozenset(subject_id.split('_')))
+        print(f"Loaded {len(self.subjects)} reference subjects from {table_file}", flush=True)
+    
+    def lookup(self, subject_id):
+        """Return (species name, token set) of a subject id"""
+        info = self.subjects.get(subject_id)
+        if info is None:
+            info = (extract_species_name(subject_id), frozenset(subject_id.split('_')))
+            self.subjects[subject_id] = info
+        return info
+
+def write_subject_table(reference_file, table_file):
+    """
+    Write subject_id, species name and display name of every reference
+    header; subject ids are the first word of the sanitized (space -> hyphen) header
+    """
+    count = 0
+    with open(reference_file, 'r', encoding='utf-8') as infile, \
+         open(table_file, 'w', encoding='utf-8') as outfile:
+        outfile.write("#subject_id\tspecies\tdisplay_name\n")
+        for line in infile:
+            if not line.startswith('>'):
+                continue
+            display_name = line[1:].strip()
+            words = display_name.replace(' ', '-').split()
+            if not words:
+                continue
+            subject_id = words[0]
+            outfile.write(f"{subject_id}\t{extract_species_name(subject_id)}\t{display_name.replace(chr(9), ' ')}\n")
+            count += 1
+    return count
+
+def iter_read_hits(blnfile_name):
+    """
+    Yield (read_id, [(subject, identity, line), ...]) for each run of
+    consecutive hit lines of the same read; only the first three columns are parsed
+    """
+    current_id = None
+    hits = []
+    seen = set()
+    total_lines = 0
+    label = Path(blnfile_name).name.split('.')[0]
+    
+    with open(blnfile_name, 'r', encoding='utf-8') as file:
+        for line in file:
+            total_lines += 1
+            if total_lines % 1000 == 0:
+                print(f"{label}: reading line {total_lines}...", flush=True)
+            
+            line = line.rstrip()
+            if not line:  # skip empty lines
+                continue
+            
+            read_id, species, identity, _ = line.split(',', 3)
+            
+            # -- No longer filter out sp. or china species, keep all hits
+            if read_id != current_id:
+                if hits:
+                    yield current_id, hits
+                if read_id in seen:
+                    print(f"Warning: hits of {read_id} are not contiguous, assigning each run separately", flush=True)
+                seen.add(read_id)
+                current_id = read_id
+                hits = []
+            hits.append((species, float(identity), line))
+    
+    if hits:
+        yield current_id, hits
+    
+    print(f"{label}: finished reading {total_lines} lines, found {len(seen)} unique reads", flush=True)
+
+def choose_hit(hits, keyword, identity_threshold, subjects):
+    """Pick the (subject, identity, line) hit of one read by the priority order above"""
+    # -- Priority 1: check keyword + identity >= threshold
+    if keyword:
+        for hit in hits:
+            species, identity, line = hit
+            if identity >= identity_threshold and keyword in subjects.lookup(species)[1]:
+                return hit
+    
+    # -- Priority 2: if no keyword match, choose first with identity >= threshold
+    for hit in hits:
+        if hit[1] >= identity_threshold:
+            return hit
+    
+    # -- Priority 3: if none above, choose the first one
+    return hits[0]
+
+def assign_project(blnfile_name, keyword, identity_threshold):
+    """Assign every read of one project's .dloop.bln; returns (project, assigned reads, output file)"""
+    species_name = blnfile_name.name.split('.')[0] # -- select all names before the first "."
+    print(f"Processing: {blnfile_name}", flush=True)
+    
+    output_dir = Path("/app/data/outputs/assign")
+    output_dir.mkdir(parents=True, exist_ok=True)
+    
+    outfile_path = output_dir / f"{species_name}.assign.species"
+    
+    print(f"{species_name}: output will be written to: {outfile_path}", flush=True)
+    
+    subjects = SubjectTable()
+    
+    assigned_count = 0
+    with open(outfile_path, "w") as outfile:
+        # -- blastn writes the hits of a read together, so each read is assigned as soon as its hits are read
+        for read_id, hits in iter_read_hits(blnfile_name):
+            assigned_count += 1
+            if assigned_count % 10000 == 0:
+                print(f"{species_name}: assigned {assigned_count} reads...", flush=True)
+            
+            species, identity, line = choose_hit(hits, keyword, identity_threshold, subjects)
+            print_line = subjects.lookup(species)[0] + ',' + str(identity) + ',' + line
+            outfile.write(read_id + ',' + print_line + '\n')
+    
+    return species_name, assigned_count, outfile_path
+
+def _assign_project(args):
+    return assign_project(*args)
+
+def report_projects(results, total):
+    for done, (species_name, assigned_count, outfile_path) in enumerate(results, 1):
+        print(f"Project {done}/{total} completed: {species_name}, "
+              f"assigned {assigned_count} reads to {outfile_path}", flush=True)
+
+def species_assignment(keyword, identity_threshold, workers=None):
+    # -- Find the dloop.bln files of all projects in the blast output directory
     blast_dir = Path("/app/data/outputs/blast")
     
     if not blast_dir.exists():
         print(f"Error: Blast output directory does not exist: {blast_dir}", flush=True)
         sys.exit(1)
     
-    dloop_files = list(blast_dir.glob("*.dloop.bln"))
+    dloop_files = sorted(blast_dir.glob("*.dloop.bln"))
     
     if len(dloop_files) == 0:
         print(f"Error: No .dloop.bln file found in {blast_dir}", flush=True)
         sys.exit(1)
-    elif len(dloop_files) > 1:
-        print(f"Warning: Multiple .dloop.bln files found, using the first one", flush=True)
     
-    blnfile_name = dloop_files[0]
-    print(f"Processing: {blnfile_name}", flush=True)
+    print(f"Found {len(dloop_files)} {'project' if len(dloop_files) == 1 else 'projects'}: "
+          f"{', '.join(f.name.split('.')[0] for f in dloop_files)}", flush=True)
 
     has_keyword = keyword and keyword.strip()
     if has_keyword:
@@ -37,87 +190,18 @@ def species_assignment(keyword, identity_threshold):
     else:
         print(f"No keyword provided, using identity threshold: {identity_threshold}", flush=True)
     
-    species_name = blnfile_name.name.split('.')[0] # -- select all names before the first "."
+    jobs = [(blnfile_name, keyword if has_keyword else None, identity_threshold) for blnfile_name in dloop_files]
     
-    output_dir = Path("/app/data/outputs/assign")
-    output_dir.mkdir(parents=True, exist_ok=True)
-    
-    outfile_path = output_dir / f"{species_name}.assign.species"
-    outfile = open(outfile_path, "w")
-    
-    print(f"Output will be written to: {outfile_path}", flush=True)
-    
-    # -- read bln+species file
-    dt = {}
-    total_lines = 0
-
-    species_pattern = re.compile(r'[A-Z][a-z]+-[a-z]+')
+    if workers is None:
+        workers = min(len(jobs), os.cpu_count() or 1)
     
-    with open(blnfile_name, 'r', encoding='utf-8') as file:
-        for i, line in enumerate(file):
-            total_lines += 1
-            if total_lines % 1000 == 0:
-                print(f"Reading line {total_lines}...", flush=True)
-            
-            line = line.rstrip()
-            if not line:  # skip empty lines
-                continue
-                
-            fields = line.split(',')
-            read_id = fields[0]
-            identity = float(fields[2])
-            species = fields[1]
-
-            match = species_pattern.search(species)
-            if match:
-                extracted_species_name = match.group(0)
-            else: 
-                extracted_species_name = species.split('-')[0] if '-' in species else species
-            
-            # -- No longer filter out sp. or china species, keep all hits
-            if read_id in dt:
-                dt[read_id].append([extracted_species_name, species, identity, line])
-            else:
-                dt[read_id] = [[extracted_species_name, species, identity, line]]
-    
-    print(f"Finished reading {total_lines} lines, found {len(dt)} unique reads", flush=True)
-    
-    assigned_count = 0
-    for read_id in dt.keys():
-        assigned_count += 1
-        if assigned_count % 10000 == 0:
-            print(f"Assigned {assigned_count} reads...", flush=True)
-        
-        # -- Priority 1: check keyword + identity >= threshold
-        priority = 0 
-        if has_keyword:
-            for i, hit in enumerate(dt[read_id]):
-                extracted_species_name, species, identity, line = hit
-                full_species_info = species.split('_')
-                if keyword in full_species_info and identity >= identity_threshold:
-                    print_line = extracted_species_name + ',' + str(identity) + ',' + line
-                    priority = 1
-                    break
-        
-        # -- Priority 2: if no keyword match, choose first with identity >= threshold
-        secondary = 0
-        if not priority:
-            for i, hit in enumerate(dt[read_id]):
-                extracted_species_name, species, identity, line = hit
-                if identity >= identity_threshold:
-                    print_line = extracted_species_name + ',' + str(identity) + ',' + line
-                    secondary = 1
-                    break
-        
-        # -- Priority 3: if none above, choose the first one
-        if not priority and not secondary: 
-            extracted_species_name, species, identity, line = dt[read_id][0]
-            print_line = extracted_species_name + ',' + str(identity) + ',' + line
-        
-        outfile.write(read_id + ',' + print_line + '\n')
+    if workers <= 1:
+        report_projects(map(_assign_project, jobs), len(jobs))
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            report_projects(pool.imap_unordered(_assign_project, jobs), len(jobs))
     
-    outfile.close()
-    print(f"Species assignment completed! Assigned {assigned_count} reads to {outfile_path}", flush=True)
+    print(f"Species assignment completed for {len(jobs)} {'project' if len(jobs) == 1 else 'projects'}!", flush=True)
 
 if __name__ == "__main__":
     if len(sys.argv) != 3:
@@ -4,7 +4,83 @@ import subprocess
 import os
 # import logging
 import sys
+import fcntl
+import shutil
+import hashlib
+import sqlite3
+import argparse
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# -- shared helpers live in python_scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from seq_stats import count_records
+from seq_io import read_fasta, fasta_id
+from assign_species import write_subject_table, extract_species_name, SubjectTable, choose_hit
+from kmerIndex import KmerIndex
+
+SUBJECT_TABLE_NAME = "subjects.tsv"
+ACCESSION_MAP_NAME = "accessions.tsv"
+
+class BlastHitCache:
+    """
+    Hit rows of unique sequences kept across runs in SQLite, keyed by
+    (sequence hash, reference hash, blast parameters). Sequences without any
+    hit are stored too, with empty rows, so they are not searched again.
+    """
+    
+    def __init__(self, cache_file="/app/data/cache/blast_hits.sqlite"):
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        # -- several runs may share the cache; writers wait for each other
+        self.connection = sqlite3.connect(cache_file, timeout=300)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS hits ("
+            " sequence_hash TEXT NOT NULL,"
+            " reference_hash TEXT NOT NULL,"
+            " params TEXT NOT NULL,"
+            " rows TEXT NOT NULL,"
+            " PRIMARY KEY (sequence_hash, reference_hash, params))"
+        )
+        self.connection.commit()
+    
+    @staticmethod
+    def sequence_hash(sequence):
+        return hashlib.sha1(sequence.encode('ascii', 'replace')).hexdigest()
+    
+    def lookup(self, sequences, reference_hash, params):
+        """Return {index: [hit row without qseqid, ...]} of the sequences already in the cache"""
+        index_of = {}
+        for index, sequence in enumerate(sequences):
+            index_of.setdefault(self.sequence_hash(sequence), []).append(index)
+        
+        found = {}
+        keys = list(index_of)
+        # -- stay below SQLite's bound parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            cursor = self.connection.execute(
+                "SELECT sequence_hash, rows FROM hits WHERE reference_hash = ? AND params = ?"
+                f" AND sequence_hash IN ({','.join('?' * len(chunk))})",
+                [reference_hash, params, *chunk]
+            )
+            for sequence_hash, rows in cursor:
+                for index in index_of[sequence_hash]:
+                    found[index] = rows.splitlines(keepends=True)
+        
+        return found
+    
+    def store(self, sequences, hits, reference_hash, params):
+        """Save the hit rows (possibly none) of every sequence in sequences ({index: sequence})"""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO hits VALUES (?, ?, ?, ?)",
+                ((self.sequence_hash(sequence), reference_hash, params, ''.join(hits.get(index, ())))
+                 for index, sequence in sequences.items())
+            )
+    
+    def close(self):
+        self.connection.close()
 
 class BLASTTools:
     """BLAST Tool Wrapper"""
@@ -13,6 +89,9 @@ class BLASTTools:
         
         # -- check if running in Docker environment
         self.in_docker = os.path.exists("/app") and os.path.exists("/.dockerenv")
+        
+        # -- sanitized references and their BLAST databases, one directory per reference content hash
+        self.blastdb_cache_dir = "/app/data/cache/blastdb"
     
     def run_command(self, cmd, cwd=None, capture_output=True):
         try:
@@ -76,26 +155,326 @@ class BLASTTools:
         
         return output_file
     
-    def count_sequences_in_fasta(self, fasta_file):
-        """Count NCBI sequence amount"""
+    def dereplicate_fasta(self, query_file, unique_file, label):
+        """
+        Collapse identical query sequences, writing each unique sequence once
+        with its abundance (>label_uN;size=count) to unique_file
+        Returns (reads, sequences): reads lists (read_id, unique index) in input order
+        """
+        unique_index = {}
+        abundances = []
+        sequences = []
+        reads = []
+        
+        for header, sequence in read_fasta(query_file):
+            index = unique_index.get(sequence)
+            if index is None:
+                index = unique_index[sequence] = len(sequences)
+                sequences.append(sequence)
+                abundances.append(0)
+            abundances[index] += 1
+            # -- blastn reports the first word of the header as qseqid
+            reads.append((fasta_id(header), index))
+        
+        self.write_unique_fasta(unique_file, label, sequences, abundances, range(len(sequences)))
+        
+        return reads, sequences, abundances
+    
+    def write_unique_fasta(self, unique_file, label, sequences, abundances, indices):
+        """Write the unique sequences at indices as >label_uN;size=count records"""
+        with open(unique_file, 'w') as f:
+            for index in indices:
+                f.write(f">{label}_u{index + 1};size={abundances[index]}\n{sequences[index]}\n")
+    
+    def blastn_sharded(self, query_file, query_count, database, output_prefix, cpu_budget,
+                       min_shard_size=50, num_alignments=10):
+        """
+        Split the query FASTA into shards and run them as concurrent
+        single-threaded blastn processes, at most cpu_budget at a time
+        Returns the shard output files in query order
+        """
+        workers = max(1, min(cpu_budget, query_count // min_shard_size))
+        if workers == 1:
+            # -- too few queries to be worth splitting
+            output_file = f"{output_prefix}.bln"
+            self.blastn(query_file, database, output_file, outfmt=10,
+                        num_alignments=num_alignments, num_threads=cpu_budget)
+            return [output_file]
+        
+        # -- a few shards per worker, so progress is reported often and stragglers are short
+        shard_count = min(workers * 4, max(1, query_count // min_shard_size))
+        shard_size = -(-query_count // shard_count)
+        shard_files = []
+        
+        with open(query_file, 'r') as f:
+            shard = None
+            for i, header in enumerate(f):
+                if i % shard_size == 0:
+                    if shard:
+                        shard.close()
+                    shard_files.append(f"{output_prefix}.shard{len(shard_files) + 1}.fasta")
+                    shard = open(shard_files[-1], 'w')
+                # -- the dereplicated FASTA has one sequence line per record
+                shard.write(header)
+                shard.write(f.readline())
+            if shard:
+                shard.close()
+        
+        output_files = [shard_file[:-len(".fasta")] + ".bln" for shard_file in shard_files]
+        print(f"  Running {len(shard_files)} blastn shards on {workers} CPUs", flush=True)
+        
         try:
-            count = 0
-            with open(fasta_file, 'r') as f:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                jobs = {
+                    pool.submit(self.blastn, shard_file, database, output_file, outfmt=10,
+                                num_alignments=num_alignments, num_threads=1): n
+                    for n, (shard_file, output_file) in enumerate(zip(shard_files, output_files), 1)
+                }
+                for done, job in enumerate(as_completed(jobs), 1):
+                    job.result()
+                    print(f"  Shard {jobs[job]}/{len(shard_files)} completed ({done}/{len(shard_files)} done)", flush=True)
+        finally:
+            for shard_file in shard_files:
+                os.remove(shard_file)
+        
+        return output_files
+    
+    def parse_unique_hits(self, unique_outputs):
+        """Return {unique index: [hit row without qseqid, ...]} from blastn outputs of unique sequences"""
+        hits = {}
+        for unique_output in unique_outputs:
+            with open(unique_output, 'r') as f:
                 for line in f:
-                    if line.startswith('>'):
-                        count += 1
-            return count
+                    if not line.strip():
+                        continue
+                    qseqid, rest = line.split(',', 1)
+                    # -- label_uN;size=count -> N - 1
+                    index = int(qseqid.split(';')[0].rsplit('_u', 1)[1]) - 1
+                    hits.setdefault(index, []).append(rest)
+        return hits
+    
+    def expand_hits(self, hits, reads, output_file):
+        """
+        Write the hits of every unique sequence once per read carrying it, in
+        the original read order, so the rows match a BLAST of all reads
+        """
+        
+        hit_count = 0
+        with open(output_file, 'w') as f:
+            for read_id, index in reads:
+                for rest in hits.get(index, ()):
+                    f.write(f"{read_id},{rest}")
+                    hit_count += 1
+        
+        return hit_count
+    
+    def exact_match_hits(self, kmer_index, subjects, sequences, indices, num_alignments,
+                         keyword=None, identity_threshold=98):
+        """
+        k-mer fast path: return {unique index: synthesized hit rows} for the
+        sequences found verbatim in the reference whose exact hits all
+        belong to one species; anything else is left for blastn.
+        With a keyword, assign_species.py prefers any hit carrying it, which
+        may be an inexact one of another species, so sequences are only
+        resolved when one of their exact hits carries the keyword.
+        """
+        resolved = {}
+        if identity_threshold > 100:
+            return resolved  # -- not even an exact hit passes; assignment falls back to blastn's first hit
+        for index in indices:
+            sequence = sequences[index]
+            exact = kmer_index.exact_hits(sequence)
+            if not exact:
+                continue
+            lookups = [subjects.lookup(kmer_index.names[ref_index]) for ref_index, _, _ in exact]
+            if len({species for species, _ in lookups}) != 1:
+                continue
+            if keyword and not any(keyword in tokens for _, tokens in lookups):
+                continue
+            resolved[index] = kmer_index.blast_rows(exact, len(sequence), num_alignments)
+        return resolved
+    
+    def assigned_species(self, rows, subjects, keyword, identity_threshold):
+        """Species assign_species.py would give a sequence with these hit rows, or None without hits"""
+        if not rows:
+            return None
+        row_hits = []
+        for row in rows:
+            subject, identity, _ = row.split(',', 2)
+            row_hits.append((subject, float(identity), row))
+        subject, _, _ = choose_hit(row_hits, keyword, identity_threshold, subjects)
+        return subjects.lookup(subject)[0]
+    
+    def verify_fast_path(self, fast_hits, hits, subjects, label, keyword=None, identity_threshold=98):
+        """
+        Compare the species assigned from the exact-match rows with the one
+        assigned from the blastn rows of each sequence, choosing the hit with
+        the same keyword and identity threshold as assign_species.py
+        """
+        agree = 0
+        disagree = []
+        for index, rows in fast_hits.items():
+            fast_species = self.assigned_species(rows, subjects, keyword, identity_threshold)
+            blast_species = self.assigned_species(hits.get(index), subjects, keyword, identity_threshold)
+            if fast_species == blast_species:
+                agree += 1
+            else:
+                disagree.append((index, fast_species, blast_species))
+        
+        print(f"  Fast path verification: {agree}/{len(fast_hits)} sequences agree with blastn", flush=True)
+        for index, fast_species, blast_species in disagree[:10]:
+            print(f"    - {label}_u{index + 1}: k-mer {fast_species}, blastn {blast_species}", flush=True)
+        if len(disagree) > 10:
+            print(f"    ... and {len(disagree) - 10} more", flush=True)
+        return agree, disagree
+    
+    def count_sequences_in_fasta(self, fasta_file):
+        """Count NCBI sequence amount (cached by path, size and mtime)"""
+        try:
+            return count_records(fasta_file)
         except Exception as e:
             print(f"Error counting sequences in {fasta_file}: {e}", flush=True)
             return 0
     
-    def sanitize_fasta(self, input_file):
+    def reference_hash(self, reference_file):
+        """SHA-256 of the reference file content"""
+        digest = hashlib.sha256()
+        with open(reference_file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def cached_blast_db(self, reference_file, compact=None):
+        """
+        Return (BLAST database name, cache key) of a reference, building the sanitized
+        FASTA and makeblastdb index only if this reference content has not been
+        built before. Builds hold an exclusive lock and are published with an
+        atomic rename, so concurrent runs never see a half-written database.
+        The subject table used by species assignment is kept in the same directory.
+        
+        compact: None, 'identical' or 'contained' to build the database from
+        the compacted reference (see compact_fasta); each mode is cached separately
+        """
+        digest = self.reference_hash(reference_file)
+        key = f"{digest}-{compact}" if compact else digest
+        cache_dir = Path(self.blastdb_cache_dir)
+        db_dir = cache_dir / key
+        db_name = db_dir / "reference.fasta"
+        
+        if db_dir.exists():
+            print(f"Reusing cached BLAST database: {db_dir}", flush=True)
+            return str(db_name), key
+        
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        with open(cache_dir / f"{key}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            
+            # -- another run may have finished the build while we waited
+            if db_dir.exists():
+                print(f"Reusing cached BLAST database: {db_dir}", flush=True)
+                return str(db_name), key
+            
+            # -- leftovers of interrupted builds
+            for stale_dir in cache_dir.glob(f"{key}.tmp-*"):
+                shutil.rmtree(stale_dir, ignore_errors=True)
+            
+            build_dir = cache_dir / f"{key}.tmp-{os.getpid()}"
+            build_dir.mkdir()
+            try:
+                build_name = build_dir / "reference.fasta"
+                if compact:
+                    sanitized_name = build_dir / "sanitized.fasta"
+                    self.sanitize_fasta(reference_file, sanitized_name)
+                    self.compact_fasta(sanitized_name, build_name, build_dir / ACCESSION_MAP_NAME,
+                                       contained=(compact == 'contained'))
+                    os.remove(sanitized_name)
+                else:
+                    self.sanitize_fasta(reference_file, build_name)
+                self.makeblastdb(build_name)
+                self.build_subject_table(reference_file, build_dir / SUBJECT_TABLE_NAME)
+                os.rename(build_dir, db_dir)
+            except Exception:
+                shutil.rmtree(build_dir, ignore_errors=True)
+                raise
+        
+        print(f"Cached BLAST database: {db_dir}", flush=True)
+        return str(db_name), key
+    
+    def compact_fasta(self, input_file, output_file, map_file, contained=False):
+        """
+        Collapse identical sequences of the same species into one record,
+        keeping the first accession as representative; with contained=True,
+        sequences lying inside a longer one of the same species are dropped too.
+        Every dropped accession is written to map_file next to its representative.
+        """
+        print(f"Compacting reference: {input_file} -> {output_file}", flush=True)
+        
+        # -- species -> [(subject id, header line, sequence), ...] in file order
+        by_species = {}
+        for header, sequence in read_fasta(input_file):
+            subject_id = fasta_id(header)
+            by_species.setdefault(extract_species_name(subject_id), []).append((subject_id, header, sequence))
+        
+        total = 0
+        kept = []
+        mapping = []
+        for records in by_species.values():
+            total += len(records)
+            representatives = {}  # -- upper-case sequence -> representative subject id
+            species_kept = []
+            for subject_id, record_header, sequence in records:
+                key = sequence.upper()
+                if key in representatives:
+                    mapping.append((representatives[key], subject_id, 'identical'))
+                    continue
+                representatives[key] = subject_id
+                species_kept.append((subject_id, record_header, sequence, key))
+            
+            if contained:
+                # -- longest first, so a sequence can only be contained in one already kept
+                longest_first = sorted(species_kept, key=lambda record: -len(record[3]))
+                survivors = []
+                for record in longest_first:
+                    container = next((other for other in survivors if record[3] in other[3]), None)
+                    if container is None:
+                        survivors.append(record)
+                    else:
+                        mapping.append((container[0], record[0], 'contained'))
+                surviving_ids = {record[0] for record in survivors}
+                species_kept = [record for record in species_kept if record[0] in surviving_ids]
+            
+            kept.extend(species_kept)
+        
+        with open(output_file, 'w', encoding='utf-8') as outfile:
+            for _, record_header, sequence, _ in kept:
+                outfile.write(f"{record_header}\n{sequence}\n")
+        
+        with open(map_file, 'w', encoding='utf-8') as mapfile:
+            mapfile.write("#representative\taccession\treason\n")
+            for subject_id, _, _, _ in kept:
+                mapfile.write(f"{subject_id}\t{subject_id}\trepresentative\n")
+            for representative, subject_id, reason in mapping:
+                mapfile.write(f"{representative}\t{subject_id}\t{reason}\n")
+        
+        print(f"Compacted {total} sequences into {len(kept)} "
+              f"({total - len(kept)} redundant accessions mapped in {Path(map_file).name})", flush=True)
+        return len(kept)
+    
+    def build_subject_table(self, reference_file, table_file):
+        """Write the reference subject table atomically"""
+        temp_file = Path(f"{table_file}.tmp-{os.getpid()}")
+        count = write_subject_table(reference_file, temp_file)
+        os.replace(temp_file, table_file)
+        print(f"Subject table: {count} subjects", flush=True)
+    
+    def sanitize_fasta(self, input_file, output_file=None):
         """
         Sanitize FASTA file by replacing spaces with hyphens in headers
         Returns path to cleaned file
         """
         try:
-            output_file = str(input_file) + ".hyphenated"
+            if output_file is None:
+                output_file = str(input_file) + ".hyphenated"
             print(f"Sanitizing FASTA file: {input_file} -> {output_file}", flush=True)
             
             count = 0
@@ -116,8 +495,10 @@ class BLASTTools:
             print(f"Error sanitizing FASTA file: {e}", flush=True)
             raise
 
-def BLAST(ncbi_reference):
+def BLAST(ncbi_reference, cpu_budget=None, fast_path=False, verify_fast_path=False, compact=None,
+          keyword=None, identity_threshold=98):
     tools = BLASTTools()
+    cpu_budget = cpu_budget or os.cpu_count() or 1
     
     print("=" * 40, flush=True)
     print("BLAST - Species Assignment\n", flush=True)
@@ -133,30 +514,30 @@ def BLAST(ncbi_reference):
     
     print(f"NCBI reference: {ncbi_reference}", flush=True)
     
-    # -- Sanitize NCBI reference (replace spaces with hyphens)
+    # -- Sanitize NCBI reference (replace spaces with hyphens) and makeblastdb,
+    # -- reusing the cached database when this reference content was built before
+    print(f"\nProcessing makeblastdb...", flush=True)
     try:
-        sanitized_reference = tools.sanitize_fasta(ncbi_reference)
-        # Use sanitized file for subsequent operations
-        print(f"Using sanitized reference: {sanitized_reference}", flush=True)
-        
-        # Determine actual reference to use (switching to sanitized version)
-        blast_db_reference = sanitized_reference
+        blast_db_reference, reference_hash = tools.cached_blast_db(ncbi_reference, compact)
+        print(f"Using sanitized reference: {blast_db_reference}", flush=True)
     except Exception as e:
-        print(f"Failed to sanitize reference: {e}", flush=True)
+        print(f"makeblastdb creation failed: {e}", flush=True)
         return
 
+    # -- species assignment joins hits to this table instead of parsing every subject id
+    shutil.copyfile(Path(blast_db_reference).parent / SUBJECT_TABLE_NAME,
+                    f"{blast_output_dir}/reference.subjects.tsv")
+    
+    # -- hits of a compacted database name representatives only; keep the provenance with the results
+    accession_map = Path(blast_db_reference).parent / ACCESSION_MAP_NAME
+    if accession_map.exists():
+        shutil.copyfile(accession_map, f"{blast_output_dir}/reference.accessions.tsv")
+    elif os.path.exists(f"{blast_output_dir}/reference.accessions.tsv"):
+        os.remove(f"{blast_output_dir}/reference.accessions.tsv")
+    
     # -- check NCBI sequence amount
     ref_seq_count = tools.count_sequences_in_fasta(blast_db_reference)
     print(f"NCBI reference sequence amount: {ref_seq_count}", flush=True)
-    
-    # -- makeblastdb
-    print(f"\nProcessing makeblastdb...", flush=True)
-    try:
-        db_name = tools.makeblastdb(blast_db_reference)
-        print(f"makeblastdb created successfully: {db_name}", flush=True)
-    except Exception as e:
-        print(f"makeblastdb creation failed: {e}", flush=True)
-        return
     print(flush=True)
     
     # -- find all .assembled.len.fa files
@@ -180,6 +561,17 @@ def BLAST(ncbi_reference):
     
     print(f"\nFound {len(species_files)} species {'file' if len(species_files) == 1 else 'files'}", flush=True)
     
+    # -- hit rows depend on the reference content and the search parameters
+    num_alignments = 10
+    blast_params = f"blastn;outfmt=10;num_alignments={num_alignments}"
+    hit_cache = BlastHitCache()
+    
+    # -- reads found verbatim in the reference can skip blastn; verification runs blastn on them too
+    kmer_index = None
+    if fast_path or verify_fast_path:
+        kmer_index = KmerIndex.cached(blast_db_reference, Path(blast_db_reference).parent)
+        subjects = SubjectTable(Path(blast_db_reference).parent / SUBJECT_TABLE_NAME)
+    
     # -- process every species
     results = {}
     for species_data in species_files:
@@ -190,14 +582,59 @@ def BLAST(ncbi_reference):
         print(f"\nProcessing species: {species}", flush=True)
         
         try:
-            blast_result = tools.blastn(
-                query_file=input_file,
-                database=blast_db_reference,
-                output_file=output_file,
-                outfmt=10,
-                num_alignments=10,
-                num_threads=4
-            )
+            # -- BLAST each distinct sequence once, then copy its hits to every read carrying it
+            unique_file = f"{blast_output_dir}/{species}.unique.fasta"
+            reads, sequences, abundances = tools.dereplicate_fasta(input_file, unique_file, species)
+            print(f"  Dereplicated {len(reads)} reads into {len(sequences)} unique sequences: "
+                  f"{Path(unique_file).name}", flush=True)
+            
+            # -- only sequences never searched against this reference go to blastn
+            hits = hit_cache.lookup(sequences, reference_hash, blast_params)
+            missing = [index for index in range(len(sequences)) if index not in hits]
+            print(f"  Hit cache: {len(hits)} cached, {len(missing)} to search", flush=True)
+            
+            fast_hits = {}
+            if kmer_index is not None:
+                candidates = range(len(sequences)) if verify_fast_path else missing
+                fast_hits = tools.exact_match_hits(kmer_index, subjects, sequences, candidates, num_alignments,
+                                                   keyword, identity_threshold)
+                print(f"  k-mer fast path: {len(fast_hits)} of {len(candidates)} sequences matched "
+                      f"one species exactly", flush=True)
+                if not verify_fast_path:
+                    missing = [index for index in missing if index not in fast_hits]
+            
+            if missing:
+                query_file = unique_file
+                if len(missing) < len(sequences):
+                    query_file = f"{blast_output_dir}/{species}.unique.query.fasta"
+                    tools.write_unique_fasta(query_file, species, sequences, abundances, missing)
+                
+                unique_outputs = tools.blastn_sharded(
+                    query_file=query_file,
+                    query_count=len(missing),
+                    database=blast_db_reference,
+                    output_prefix=f"{blast_output_dir}/{species}.unique",
+                    cpu_budget=cpu_budget,
+                    num_alignments=num_alignments
+                )
+                
+                new_hits = tools.parse_unique_hits(unique_outputs)
+                hit_cache.store({index: sequences[index] for index in missing}, new_hits,
+                                reference_hash, blast_params)
+                hits.update(new_hits)
+                
+                for unique_output in unique_outputs:
+                    os.remove(unique_output)
+                if query_file != unique_file:
+                    os.remove(query_file)
+            
+            if verify_fast_path:
+                tools.verify_fast_path(fast_hits, hits, subjects, species, keyword, identity_threshold)
+            else:
+                # -- synthesized rows are not stored in the hit cache, which only holds blastn results
+                hits.update(fast_hits)
+            
+            tools.expand_hits(hits, reads, output_file)
             
             print(f"{species} BLAST search completed", flush=True)
             
@@ -227,6 +664,8 @@ def BLAST(ncbi_reference):
             }
             continue
     
+    hit_cache.close()
+    
     # -- summary report
     successful = sum(1 for r in results.values() if r['success'])
     print(f"\nProcessing completed, processed {successful}/{len(results)} project", flush=True)
@@ -241,7 +680,8 @@ def list_available_files(ncbi_reference):
         print(f"\nLength filter output directory: {filter_dir}", flush=True)
         for file in sorted(Path(filter_dir).glob("*")):
             size = file.stat().st_size if file.exists() else 0
-            print(f"  {file.name} ({size} bytes)", flush=True)
+            seq_info = f", {count_records(file)} sequences" if file.suffix == '.fasta' else ""
+            print(f"  {file.name} ({size} bytes{seq_info})", flush=True)
     else:
         print(f"Length filter output directory does not exits: {filter_dir}", flush=True)
     
@@ -270,8 +710,28 @@ def list_available_files(ncbi_reference):
 
 
 if __name__ == "__main__":
-    ncbi_reference = sys.argv[1] # -- string
+    parser = argparse.ArgumentParser(description="BLAST length-filtered reads against an NCBI reference")
+    parser.add_argument("ncbi_reference")
+    parser.add_argument("--cpus", type=int, default=None,
+                        help="Total CPUs for concurrent blastn processes (default: all)")
+    parser.add_argument("--compact-reference", choices=["identical", "contained"], default=None,
+                        help="Build the database from one sequence per species for identical "
+                             "(or also contained) reference sequences")
+    parser.add_argument("--kmer-fast-path", action="store_true",
+                        help="Assign reads found verbatim in one species of the reference without blastn")
+    parser.add_argument("--verify-fast-path", action="store_true",
+                        help="Run blastn on every read and report where the k-mer fast path would disagree")
+    parser.add_argument("--keyword", default="",
+                        help="Species assignment keyword; the k-mer fast path only takes reads "
+                             "with an exact hit carrying it")
+    parser.add_argument("--identity", type=int, default=98,
+                        help="Species assignment identity threshold (default: 98)")
+    args = parser.parse_args()
+    
+    ncbi_reference = args.ncbi_reference # -- string
     list_available_files(ncbi_reference)
     print(flush=True)
     
-    BLAST(ncbi_reference)
\ No newline at end of file
+    keyword = args.keyword.strip() or None
+    BLAST(ncbi_reference, args.cpus, args.kmer_fast_path, args.verify_fast_path, args.compact_reference,
+          keyword, args.identity)
\ No newline at end of file
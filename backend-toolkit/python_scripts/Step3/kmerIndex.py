@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+"""
+Exact-match k-mer index of a BLAST reference
+Finds the reference sequences that contain a read verbatim (on either
+strand) without running blastn. Every `step`-th k-mer of each reference is
+indexed, so a read of at least k + step - 1 bases shares an indexed k-mer
+with every region it is identical to; only its first `step` k-mers need to
+be looked up, and each candidate is confirmed by a direct comparison.
+
+K-mers are packed 2 bits per base into sorted uint64 arrays, with parallel
+reference and position arrays, and looked up by binary search. The arrays
+and the concatenated reference bases are saved as .npy files and
+memory-mapped on load, so reusing an index reads almost nothing up front.
+
+Usage: python kmerIndex.py <reference_fasta> <query_fasta>
+Output: blastn -outfmt 10 style rows of the exact hits
+"""
+
+import os
+import sys
+import shutil
+from pathlib import Path
+
+# -- shared helpers live in python_scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from seq_io import read_fasta, fasta_id, reverse_complement
+
+try:
+    import numpy as np
+except ImportError:  # only needed for the k-mer fast path
+    np = None
+
+# -- e-value and bit score of synthesized rows; no search is run, so there are none to report
+PLACEHOLDER_SCORE = "NA"
+
+INVALID_CODE = 4  # -- any base other than A, C, G, T; k-mers containing one are not indexed
+INDEX_ARRAYS = ('kmers', 'refs', 'positions', 'bases', 'offsets', 'names')
+
+# -- queries are packed in pure Python: ACGT -> base-4 digits, int(..., 4)
+BASE_DIGITS = str.maketrans('ACGT', '0123')
+NON_ACGT = str.maketrans('', '', 'ACGT')
+
+if np is not None:
+    BASE_CODES = np.full(256, INVALID_CODE, dtype=np.uint8)
+    BASE_CODES[list(b'ACGT')] = np.arange(4, dtype=np.uint8)
+
+
+def read_reference(fasta_file):
+    """Return [(subject id, upper-case sequence), ...]"""
+    return [(fasta_id(header), sequence.upper()) for header, sequence in read_fasta(fasta_file)]
+
+
+def encode_bases(sequence):
+    """Upper-case sequence as uint8 bytes; non-ASCII characters become '?'"""
+    return np.frombuffer(sequence.encode('ascii', 'replace'), dtype=np.uint8)
+
+
+def pack_kmers(bases, starts, k):
+    """
+    Return (packed uint64 k-mers, valid mask) for the k-mers of bases at starts;
+    a k-mer is valid when it consists of A, C, G and T only
+    """
+    codes = BASE_CODES[bases]
+    invalid = np.concatenate(([0], np.cumsum(codes == INVALID_CODE)))
+    valid = invalid[starts + k] == invalid[starts]
+
+    kmers = np.zeros(len(starts), dtype=np.uint64)
+    for offset in range(k):
+        kmers = (kmers << np.uint64(2)) | (codes[starts + offset] & 3).astype(np.uint64)
+    return kmers, valid
+
+
+class KmerIndex:
+    """Sampled k-mer positions of every reference sequence"""
+
+    def __init__(self, k, step, names, bases, offsets, kmers, refs, positions):
+        """
+        Args:
+            k: k-mer length, at most 32 so that a k-mer fits in a uint64
+            step: Distance between indexed k-mers of a reference
+            names: [subject id, ...] indexed by reference
+            bases: All reference sequences concatenated (uint8)
+            offsets: Start of each reference in bases, followed by the total length
+            kmers: Sorted packed k-mers; refs and positions say where each one occurs
+        """
+        self.k = k
+        self.step = step
+        self.names = names
+        self.bases = bases
+        self.offsets = offsets
+        self.kmers = kmers
+        self.refs = refs
+        self.positions = positions
+
+    @classmethod
+    def build(cls, references, k=24, step=8):
+        """Index [(subject id, upper-case sequence), ...]"""
+        if np is None:
+            raise ImportError("The k-mer fast path requires NumPy to be installed")
+        if not 0 < k <= 32:
+            raise ValueError(f"k-mer length must be between 1 and 32 (got {k})")
+
+        lengths = np.array([len(sequence) for _, sequence in references], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        bases = encode_bases(''.join(sequence for _, sequence in references))
+
+        # -- (reference, position) of every step-th k-mer
+        counts = np.maximum((lengths - k) // step + 1, 0)
+        refs = np.repeat(np.arange(len(references), dtype=np.uint32), counts)
+        firsts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+        positions = (np.arange(int(counts.sum()), dtype=np.int64) - np.repeat(firsts, counts)) * step
+
+        kmers, valid = pack_kmers(bases, offsets[refs] + positions, k)
+        kmers, refs, positions = kmers[valid], refs[valid], positions[valid].astype(np.uint32)
+
+        # -- stable, so equal k-mers stay in reference and position order
+        order = np.argsort(kmers, kind='stable')
+        return cls(k, step, [name for name, _ in references], bases, offsets,
+                   kmers[order], refs[order], positions[order])
+
+    @property
+    def min_query_length(self):
+        return self.k + self.step - 1
+
+    def save(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        for name in INDEX_ARRAYS:
+            np.save(Path(index_dir) / f"{name}.npy", np.asarray(getattr(self, name)))
+
+    @classmethod
+    def load(cls, index_dir, k=24, step=8):
+        """Memory-map a saved index; only the subject ids are read into memory"""
+        # -- plain ndarray views of the maps: slicing an np.memmap costs several times more
+        arrays = {name: np.asarray(np.load(Path(index_dir) / f"{name}.npy", mmap_mode='r'))
+                  for name in INDEX_ARRAYS}
+        arrays['names'] = arrays['names'].tolist()
+        return cls(k, step, **arrays)
+
+    @classmethod
+    def cached(cls, reference_fasta, cache_dir, k=24, step=8):
+        """Load the index of a reference from cache_dir, building and saving it on first use"""
+        index_dir = Path(cache_dir) / f"kmer_k{k}_s{step}"
+        if index_dir.exists():
+            print(f"Loaded k-mer index: {index_dir}", flush=True)
+            return cls.load(index_dir, k, step)
+
+        index = cls.build(read_reference(reference_fasta), k, step)
+
+        # -- concurrent runs may build the same index; the rename keeps the directory whole
+        temp_dir = Path(f"{index_dir}.tmp-{os.getpid()}")
+        index.save(temp_dir)
+        try:
+            os.rename(temp_dir, index_dir)
+        except OSError:
+            # -- another run published it first
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        print(f"Built k-mer index: {index_dir} ({len(index.kmers)} k-mers)", flush=True)
+        return cls.load(index_dir, k, step)
+
+    def exact_hits(self, sequence):
+        """
+        Return [(reference index, start, strand), ...] of every reference
+        containing the sequence, in reference order, or None when the
+        sequence is too short to be looked up reliably or has bases other
+        than A, C, G and T
+        """
+        query = sequence.upper()
+        length = len(query)
+        if length < self.min_query_length or query.translate(NON_ACGT):
+            return None
+
+        strands = (('plus', query), ('minus', reverse_complement(query)))
+        digits = [strand_query[:self.min_query_length].translate(BASE_DIGITS) for _, strand_query in strands]
+        kmers = np.array([int(strand_digits[offset:offset + self.k], 4)
+                          for strand_digits in digits for offset in range(self.step)], dtype=np.uint64)
+        lows = self.kmers.searchsorted(kmers, side='left').tolist()
+        highs = self.kmers.searchsorted(kmers, side='right').tolist()
+
+        found = set()
+        for strand_no, (strand, strand_query) in enumerate(strands):
+            query_bytes = strand_query.encode('ascii')
+            for offset in range(self.step):
+                low, high = lows[strand_no * self.step + offset], highs[strand_no * self.step + offset]
+                if low == high:
+                    continue
+                for ref_index, position in zip(self.refs[low:high].tolist(), self.positions[low:high].tolist()):
+                    start = position - offset
+                    ref_start = int(self.offsets[ref_index]) + start
+                    if start < 0 or ref_start + length > self.offsets[ref_index + 1]:
+                        continue
+                    if self.bases[ref_start:ref_start + length].tobytes() == query_bytes:
+                        found.add((ref_index, strand, start))
+
+        # -- one hit per reference and strand, the leftmost one
+        hits = {}
+        for ref_index, strand, start in sorted(found):
+            hits.setdefault((ref_index, strand), start)
+        return [(ref_index, start, strand) for (ref_index, strand), start in sorted(hits.items())]
+
+    def blast_rows(self, hits, length, max_hits=10):
+        """
+        Format exact hits like blastn -outfmt 10 rows without the qseqid column.
+        Identity, length and coordinates are exact; the e-value and bit score
+        columns hold PLACEHOLDER_SCORE, since blastn never scored these hits.
+        """
+        rows = []
+        for ref_index, start, strand in hits[:max_hits]:
+            sstart, send = (start + 1, start + length) if strand == 'plus' else (start + length, start + 1)
+            rows.append(f"{self.names[ref_index]},100.000,{length},0,0,1,{length},"
+                        f"{sstart},{send},{PLACEHOLDER_SCORE},{PLACEHOLDER_SCORE}\n")
+        return rows
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python kmerIndex.py <reference_fasta> <query_fasta>", flush=True)
+        sys.exit(1)
+
+    index = KmerIndex.build(read_reference(sys.argv[1]))
+    for name, sequence in read_reference(sys.argv[2]):
+        hits = index.exact_hits(sequence)
+        if hits is None:
+            print(f"{name}: too short or not ACGT only", flush=True)
+            continue
+        for row in index.blast_rows(hits, len(sequence)):
+            print(f"{name},{row}", end='', flush=True)
@@ -2,160 +2,233 @@
 
 import os
 import sys
+import multiprocessing
 from pathlib import Path
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+
+# -- shared helpers live in python_scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from seq_io import read_fasta, fasta_id
 
 def parse_assign_species(assign_file):
     """
-    Parse assign.species file, return a mapping of sequence names to species
+    Parse assign.species file into a compact index of sequence names to species ids
     
     File format:
     f_3_CypDL_XkB_R1f,Opsariichthys_pachycephalus,98.605,f_3_CypDL_XkB_R1f,MG650171.1:1568816612_Opsariichthys_pachycephalus_mitochondrion_complete_genome,98.605,215,3,0,1,215,77,291,3.71e-108,381
     
     Returns:
-    - seq_to_species: { Sequence name : Species name }
+    - seq_to_species: { Sequence name : Species id }
+    - species_names: [ Species name, ... ] indexed by species id
     - species_count: { Species name : Total count }
     """
     seq_to_species = {}
+    species_ids = {}
     species_count = defaultdict(int)  # Initialize dictionary with default value 0
     
     with open(assign_file, 'r', encoding='utf-8') as f:
         for line_num, line in enumerate(f, 1):
             line = line.rstrip()
             if line:
-                parts = line.split(',')  # ['f_3_CypDL_XkB_R1f', 'Opsariichthys_pachycephalus', '98.605', 'f_3_CypDL_XkB_R1f', ...]
+                parts = line.split(',', 2)  # ['f_3_CypDL_XkB_R1f', 'Opsariichthys_pachycephalus', '98.605,...']
                 if len(parts) >= 2:
                     seq_name = parts[0]  # sequence name
                     species = parts[1]   # species name
-                    seq_to_species[seq_name] = species
+                    # -- each species name is stored once, reads only keep its id
+                    seq_to_species[seq_name] = species_ids.setdefault(species, len(species_ids))
                     species_count[species] += 1
                 else:
                     print(f"Warning: Line {line_num} has incorrect format: {line}", flush=True)
     
-    return seq_to_species, species_count
+    species_names = [None] * len(species_ids)
+    for species, species_id in species_ids.items():
+        species_names[species_id] = species
+    
+    return seq_to_species, species_names, species_count
 
 def read_fasta_sequences(fasta_file):
     """
-    Parse a FASTA file, return a dictionary of sequences.
+    Stream a FASTA file, sequences may span several lines
     
-    Returns: { sequence name: (full header, sequence) }
+    Yields: (sequence name, full header, sequence)
     """
-    sequences = {}
-    
-    with open(fasta_file, 'r', encoding='utf-8') as f:
-        while True:
-            header = f.readline().rstrip()
-            if not header:
-                break
-            sequence = f.readline().rstrip()
-            
-            if header.startswith('>'):
-                seq_name = header.split()[0][1:]
-                sequences[seq_name] = (header, sequence)
-                # Example: { f_0_CypDL_NNWra_R1f: ('>f_0_CypDL_NNWra_R1f', 'ACCCATTATT...') }
-    
-    return sequences
+    for header, seq in read_fasta(fasta_file):
+        # Example: ('f_0_CypDL_NNWra_R1f', '>f_0_CypDL_NNWra_R1f', 'ACCCATTATT...')
+        yield fasta_id(header), header, seq
 
-def classify_sequences_by_species(seq_to_species, sequences):
+class SpeciesWriters:
     """
-    Classify sequences by species
-    
-    Parameters:
-    - seq_to_species: {sequence name: species name} e.g., {f_132_ZpDL_CHR_R2f: Opsariichthys_pachycephalus}
-    - sequences: {sequence name: (header, sequence)}
-    
-    Returns:
-    - species_sequences: {species name: [(header, sequence), ...]}
-    - found_sequences: number of successfully matched sequences
-    - missing_sequences: list of sequences not found in FASTA file
+    Per-species output files with at most max_open handles open at once;
+    the least recently used one is closed and reopened for append when needed
     """
-    species_sequences = defaultdict(list)
-    found_sequences = 0  # counter
-    missing_sequences = []
     
-    for seq_name, species in seq_to_species.items():
-        if seq_name in sequences:
-            header, seq = sequences[seq_name]  # header = ">f_0_CypDL_NNWra_R1f"
-            species_sequences[species].append((header, seq))
-            found_sequences += 1
+    def __init__(self, output_dir, prefix, max_open=64):
+        self.output_dir = Path(output_dir)
+        self.prefix = prefix
+        self.max_open = max_open
+        self.handles = OrderedDict()
+        self.output_files = {}  # -- species -> path, in first-write order
+        self.counts = defaultdict(int)
+    
+    def write(self, species, header, seq):
+        handle = self.handles.get(species)
+        if handle is None:
+            handle = self._open(species)
         else:
-            missing_sequences.append(seq_name)
+            self.handles.move_to_end(species)
+        
+        handle.write(f"{header}\n{seq}\n")
+        self.counts[species] += 1
     
-    return species_sequences, found_sequences, missing_sequences
+    def _open(self, species):
+        if len(self.handles) >= self.max_open:
+            _, oldest = self.handles.popitem(last=False)
+            oldest.close()
+        
+        if species in self.output_files:
+            handle = open(self.output_files[species], 'a', encoding='utf-8')
+        else:
+            # species = "Opsariichthys_pachycephalus"
+            clean_species = species.replace(' ', '_').replace('/', '_').replace('\\', '_')
+            output_file = self.output_dir / f"{self.prefix}_{clean_species}.fasta"
+            self.output_files[species] = output_file
+            handle = open(output_file, 'w', encoding='utf-8')
+        
+        self.handles[species] = handle
+        return handle
+    
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles.clear()
 
-def write_species_fasta(species_sequences, prefix):
+def classify_sequences_by_species(seq_to_species, species_names, fasta_file, prefix, max_open=64):
     """
-    Write FASTA files for each species
+    Walk the FASTA once and append every assigned sequence to its species file
     
     Parameters:
-    - species_sequences: {species name: [(header, sequence), ...]}
-    - prefix: file prefix for output files
+    - seq_to_species: {sequence name: species id} e.g., {f_132_ZpDL_CHR_R2f: 0}
+    - species_names: [species name, ...] e.g., [Opsariichthys_pachycephalus]
+    
+    Returns:
+    - writers: SpeciesWriters with the output file and sequence count of each species
+    - found_sequences: number of successfully matched sequences
+    - missing_sequences: list of sequences not found in FASTA file
     """
-    output_files = []
     output_dir = Path("/app/data/outputs/classifier")
     output_dir.mkdir(parents=True, exist_ok=True)
     
-    for species, seqs in species_sequences.items():
-        # species = "Opsariichthys_pachycephalus" 
-        # seqs = [('>f_132_ZpDL_CHR_R2f', 'ACATAT...'), ('>f_148_ZpDL_KKK2_R1f', 'ACATAT...'), ...]
-        clean_species = species.replace(' ', '_').replace('/', '_').replace('\\', '_')
-        output_file = output_dir / f"{prefix}_{clean_species}.fasta"
-        
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for header, seq in seqs:
-                # header = ">f_132_ZpDL_CHR_R2f"
-                f.write(f"{header}\n")
-                f.write(f"{seq}\n")
-        
-        output_files.append(str(output_file))
-        print(f"Species {species}: {len(seqs)} sequences -> {output_file}", flush=True)
+    writers = SpeciesWriters(output_dir, prefix, max_open)
+    found_sequences = 0  # counter
+    found_names = set()
+    
+    try:
+        for seq_name, header, seq in read_fasta_sequences(fasta_file):
+            species_id = seq_to_species.get(seq_name)
+            if species_id is None or seq_name in found_names:
+                continue
+            # header = ">f_132_ZpDL_CHR_R2f"
+            writers.write(species_names[species_id], header, seq)
+            found_names.add(seq_name)
+            found_sequences += 1
+    finally:
+        writers.close()
     
-    return output_files
+    missing_sequences = [seq_name for seq_name in seq_to_species if seq_name not in found_names]
+    
+    return writers, found_sequences, missing_sequences
 
-if __name__ == "__main__":
-    assign_path = Path("/app/data/outputs/assign")
-    assign_f = list(assign_path.glob("*.assign.species"))
-    assign_file = str(assign_f[0])
+def find_projects(assign_path=Path("/app/data/outputs/assign"), fasta_path=Path("/app/data/outputs/filter")):
+    """Pair every <prefix>.assign.species with its <prefix>.assembled.len.fasta; returns [(prefix, assign, fasta)]"""
+    projects = []
+    for assign_file in sorted(assign_path.glob("*.assign.species")):
+        prefix = assign_file.name.split(".")[0]
+        fasta_file = fasta_path / f"{prefix}.assembled.len.fasta"
+        if not fasta_file.exists():
+            print(f"Warning: {fasta_file} not found, skipping project {prefix}", flush=True)
+            continue
+        projects.append((prefix, str(assign_file), str(fasta_file)))
+    return projects
 
-    fasta_path = Path("/app/data/outputs/filter")
-    fasta_f = list(fasta_path.glob("*.assembled.len.fasta"))
-    fasta_file = str(fasta_f[0])
-    
-    prefix = Path(assign_file).name.split(".")[0]
-    
-    print(f"Species Classifier...", flush=True)
-    print(f"Processing files:", flush=True)
-    print(f"  - assign.species: {assign_file}", flush=True)
-    print(f"  - fasta: {fasta_file}", flush=True)
-    print("=" * 50, flush=True)
+def classify_project(prefix, assign_file, fasta_file):
+    """
+    Classify one project; the report is returned as lines rather than
+    printed, so that projects running in parallel do not interleave
+    """
+    report = []
+    report.append(f"Project {prefix}:")
+    report.append(f"  - assign.species: {assign_file}")
+    report.append(f"  - fasta: {fasta_file}")
     
-    seq_to_species, species_count = parse_assign_species(assign_file)
+    seq_to_species, species_names, species_count = parse_assign_species(assign_file)
     
-    print(f"Found {len(seq_to_species)} sequence assignments", flush=True)
-    print("Species statistics:", flush=True)
+    report.append(f"Found {len(seq_to_species)} sequence assignments")
+    report.append("Species statistics:")
     for species, count in sorted(species_count.items()):
-        print(f"  - {species}: {count} sequences", flush=True)
-    print(flush=True)
-    
-    sequences = read_fasta_sequences(fasta_file)
+        report.append(f"  - {species}: {count} sequences")
     
-    species_sequences, found_sequences, missing_sequences = classify_sequences_by_species(
-        seq_to_species, sequences
+    writers, found_sequences, missing_sequences = classify_sequences_by_species(
+        seq_to_species, species_names, fasta_file, prefix
     )
 
     if missing_sequences:
-        print(f"Warning: {len(missing_sequences)} sequences not found in FASTA file:", flush=True)
+        report.append(f"Warning: {len(missing_sequences)} sequences not found in FASTA file:")
         for seq in missing_sequences[:10]:  # Show only first 10
-            print(f"  - {seq}", flush=True)
+            report.append(f"  - {seq}")
         if len(missing_sequences) > 10:
-            print(f"  ... and {len(missing_sequences) - 10} more", flush=True)
-    print(flush=True)
+            report.append(f"  ... and {len(missing_sequences) - 10} more")
+    
+    output_files = []
+    for species, output_file in writers.output_files.items():
+        output_files.append(str(output_file))
+        report.append(f"Species {species}: {writers.counts[species]} sequences -> {output_file}")
+    
+    return prefix, output_files, report
+
+def _classify_project(args):
+    return classify_project(*args)
+
+def classify_projects(projects, workers=None):
+    """Classify all projects in a process pool, printing each project's report as it finishes"""
+    if workers is None:
+        workers = min(len(projects), os.cpu_count() or 1)
+    
+    output_files = []
+    
+    def report_project(done, result):
+        prefix, project_files, report = result
+        print("\n".join(report), flush=True)
+        print(f"Project {done}/{len(projects)} completed: {prefix}", flush=True)
+        print("=" * 50, flush=True)
+        output_files.extend(project_files)
+    
+    if workers <= 1:
+        for done, result in enumerate(map(_classify_project, projects), 1):
+            report_project(done, result)
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            for done, result in enumerate(pool.imap_unordered(_classify_project, projects), 1):
+                report_project(done, result)
+    
+    return output_files
+
+if __name__ == "__main__":
+    print(f"Species Classifier...", flush=True)
+    
+    projects = find_projects()
+    if not projects:
+        print("Error: No assign.species files with a matching .assembled.len.fasta found", flush=True)
+        sys.exit(1)
+    
+    print(f"Processing {len(projects)} {'project' if len(projects) == 1 else 'projects'}: "
+          f"{', '.join(prefix for prefix, _, _ in projects)}", flush=True)
+    print("=" * 50, flush=True)
     
-    output_files = write_species_fasta(species_sequences, prefix)
+    output_files = classify_projects(projects)
     
     print(flush=True)
     print("Completed! Generated files:", flush=True)
     for file in output_files:
         if os.path.exists(file):
             size = os.path.getsize(file)
-            print(f"  - {file} ({size} bytes)", flush=True)
\ No newline at end of file
+            print(f"  - {file} ({size} bytes)", flush=True)
@@ -2,8 +2,13 @@
 
 import subprocess
 import os
+import sys
 from pathlib import Path
 
+# -- shared helpers live in python_scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from seq_stats import count_records
+
 class MAFFTTools:
     """MAFFT Tool Wrapper"""
     
@@ -80,16 +85,8 @@ class MAFFTTools:
         return output_file
 
 def count_sequences(fasta_file):
-    """Count sequences in a FASTA file"""
-    if not Path(fasta_file).exists():
-        return 0
-    
-    count = 0
-    with open(fasta_file, 'r') as f:
-        for line in f:
-            if line.startswith('>'):
-                count += 1
-    return count
+    """Count sequences in a FASTA file (cached by path, size and mtime)"""
+    return count_records(fasta_file)
 
 def get_file_size(file_path):
     """Get file size in human readable format"""
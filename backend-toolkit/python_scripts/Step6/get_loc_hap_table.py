@@ -197,49 +197,57 @@ if __name__ == "__main__":
         print(f"  - {species}", flush=True)
     print("-" * 50, flush=True)
 
-    project = str(species_dirs[0].split('_')[0])
-    locations = load_location(barcodeFile, project)
+    # -- species directories are named <project>_<species>; each project has its own locations
+    projects = {}
+    for species in species_dirs:
+        projects.setdefault(species.split('_')[0], []).append(species)
+    
+    for project, project_species in projects.items():
+        locations = load_location(barcodeFile, project)
+        print(f"Project {project}: {len(project_species)} species, {len(locations)} locations", flush=True)
 
-    all_species_data = {}
+        all_species_data = {}
 
-    # -- Proces each species
-    for species in species_dirs:
-        species_input_dir = os.path.join(input_dir, species)
-        species_output_dir = os.path.join(output_dir, species) # -- table/species
-        
-        os.makedirs(species_output_dir, exist_ok=True)
-        
-        # -- Look for .dup.list file
-        dup_list_pattern = os.path.join(species_input_dir, "*.dup.list")
-        dup_list_files = glob.glob(dup_list_pattern)
-        
-        if not dup_list_files:
-            print(f"Warning: No .dup.list file found for {species}", flush=True)
-            continue
-        
-        if len(dup_list_files) > 1:
-            print(f"Warning: Multiple .dup.list files found for {species}, using first one", flush=True)
-        
-        input_file = dup_list_files[0]
-        
-        # -- output file name
-        base_name = os.path.basename(input_file).replace('.dup.list', '')
-        output_file = os.path.join(species_output_dir, f"{base_name}.tbl.csv")
-        
-        # -- process species
-        try:
-            species_name = species
+        # -- Proces each species
+        for species in project_species:
+            species_input_dir = os.path.join(input_dir, species)
+            species_output_dir = os.path.join(output_dir, species) # -- table/species
+            
+            os.makedirs(species_output_dir, exist_ok=True)
+            
+            # -- Look for .dup.list file
+            dup_list_pattern = os.path.join(species_input_dir, "*.dup.list")
+            dup_list_files = glob.glob(dup_list_pattern)
+            
+            if not dup_list_files:
+                print(f"Warning: No .dup.list file found for {species}", flush=True)
+                continue
+            
+            if len(dup_list_files) > 1:
+                print(f"Warning: Multiple .dup.list files found for {species}, using first one", flush=True)
+            
+            input_file = dup_list_files[0]
+            
+            # -- output file name
+            base_name = os.path.basename(input_file).replace('.dup.list', '')
+            output_file = os.path.join(species_output_dir, f"{base_name}.tbl.csv")
+            
+            # -- process species
+            try:
+                species_name = species
 
-            counts_dict = generate_haplotype_table(input_file, output_file, locations)
+                counts_dict = generate_haplotype_table(input_file, output_file, locations)
 
-            all_species_data[species_name] = counts_dict
+                all_species_data[species_name] = counts_dict
 
-        except Exception as e:
-            print(f"Error processing {species}: {e}", flush=True)
-            continue
+            except Exception as e:
+                print(f"Error processing {species}: {e}", flush=True)
+                continue
 
-    if all_species_data:
-        loc_species_file = os.path.join(loc_species_dir, "Location_Species.tbl.csv")
-        generate_loc_species_table(loc_species_file, locations, all_species_data)
+        if all_species_data:
+            # -- one table per project; a single-project run keeps the original file name
+            table_name = "Location_Species.tbl.csv" if len(projects) == 1 else f"{project}.Location_Species.tbl.csv"
+            loc_species_file = os.path.join(loc_species_dir, table_name)
+            generate_loc_species_table(loc_species_file, locations, all_species_data)
 
     print("All species processed!", flush=True)
\ No newline at end of file
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+"""
+Sequence File Helpers
+Shared by the pipeline steps: opening plain or .gz inputs, reverse
+complementing reads, and streaming FASTA records whose sequence may span
+several lines.
+
+Usage: import from a step script after adding python_scripts/ to sys.path
+"""
+
+import gzip
+
+COMPLEMENT = str.maketrans('ACGTNacgtn', 'TGCANtgcan')
+
+WRITE_BUFFER_SIZE = 1 << 20  # -- buffering of the steps' sequence output files
+
+
+def open_sequence_file(path, mode='r'):
+    """Open a file for reading as text ('r') or bytes ('rb'), transparently decompressing .gz files"""
+    binary = 'b' in mode
+    if str(path).endswith('.gz'):
+        return gzip.open(path, 'rb' if binary else 'rt', encoding=None if binary else 'utf-8')
+    if binary:
+        return open(path, 'rb')
+    return open(path, 'r', encoding='utf-8')
+
+
+def reverse_complement(sequence):
+    return sequence.translate(COMPLEMENT)[::-1]
+
+
+def fasta_id(header):
+    """First word of a '>' header line, the id blastn and makeblastdb use"""
+    words = header[1:].split()
+    return words[0] if words else ''
+
+
+def read_fasta(fasta_file):
+    """
+    Stream a FASTA file, sequences may span several lines
+
+    Yields: (header line with '>' and without trailing whitespace, sequence)
+    """
+    header = None
+    chunks = []
+
+    with open_sequence_file(fasta_file) as f:
+        for line in f:
+            if line.startswith('>'):
+                if header is not None:
+                    yield header, ''.join(chunks)
+                header = line.rstrip()
+                chunks = []
+            elif header is not None:
+                chunks.append(line.strip())
+
+    if header is not None:
+        yield header, ''.join(chunks)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+"""
+Sequence File Statistics
+Counts records and residues of FASTA/FASTQ files (optionally .gz) by scanning
+1 MB blocks with bytes.count, and caches the results in a small JSON sidecar
+keyed by path, size and mtime, so repeated listings and summaries are free.
+
+Usage: python seq_stats.py <file> [<file> ...]
+Output: JSON format with records and residues per file
+"""
+
+import os
+import sys
+import json
+import stat
+import tempfile
+
+from seq_io import open_sequence_file
+
+BLOCK_SIZE = 1 << 20
+CACHE_FILE = "/app/data/cache/seq_stats.json"
+
+FASTQ_SUFFIXES = ('.fq', '.fastq')
+
+_cache = None
+
+
+def is_regular_file(path) -> bool:
+    """False for FIFOs, devices and missing paths, which must never be opened for scanning"""
+    try:
+        return stat.S_ISREG(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def is_fastq(path) -> bool:
+    """
+    FASTQ files are recognised by suffix (.fq/.fastq, optionally .gz); everything else is FASTA.
+    Paths that exist but are not regular files (e.g. a streaming FIFO) are never FASTQ.
+    """
+    if os.path.exists(path) and not is_regular_file(path):
+        return False
+    name = str(path)
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return name.endswith(FASTQ_SUFFIXES)
+
+
+def _iter_line_chunks(path):
+    """Yield blocks of whole lines, each ending with a newline"""
+    carry = b''
+    with open_sequence_file(path, 'rb') as f:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+
+            block = carry + block
+            cut = block.rfind(b'\n') + 1
+            if cut == 0:
+                carry = block
+                continue
+
+            carry = block[cut:]
+            yield block[:cut]
+
+    if carry:
+        yield carry + b'\n'
+
+
+def _scan_fasta(path) -> dict:
+    """Records are lines starting with '>', residues are the bytes of all other lines"""
+    records = 0
+    residues = 0
+
+    for chunk in _iter_line_chunks(path):
+        header_bytes = 0
+        header_crs = 0
+        headers = 0
+
+        position = 0 if chunk.startswith(b'>') else chunk.find(b'\n>') + 1
+        while position > 0 or (headers == 0 and chunk.startswith(b'>')):
+            line_end = chunk.find(b'\n', position)
+            header_bytes += line_end + 1 - position
+            header_crs += chunk[line_end - 1] == 13 # -- '\r'
+            headers += 1
+            position = chunk.find(b'\n>', line_end) + 1
+
+        # -- what is left are sequence lines and their line endings
+        line_endings = (chunk.count(b'\n') - headers) + (chunk.count(b'\r') - header_crs)
+        records += headers
+        residues += len(chunk) - header_bytes - line_endings
+
+    return {'records': records, 'residues': residues}
+
+
+def _scan_fastq(path) -> dict:
+    """Records are complete groups of 4 lines, residues are the lengths of their sequence lines"""
+    lines = 0
+    residues = 0
+
+    for chunk in _iter_line_chunks(path):
+        chunk_lines = chunk.split(b'\n')[:-1]
+        # -- sequence lines are line 2 of every record
+        residues += sum(len(line.rstrip()) for line in chunk_lines[(1 - lines) % 4::4])
+        lines += len(chunk_lines)
+
+    return {'records': lines // 4, 'residues': residues}
+
+
+def _load_cache() -> dict:
+    global _cache
+    if _cache is None:
+        try:
+            with open(CACHE_FILE, 'r', encoding='utf-8') as f:
+                _cache = json.load(f)
+        except (OSError, ValueError):
+            _cache = {}
+    return _cache
+
+
+def _save_cache(cache: dict) -> None:
+    """Write the cache atomically, dropping entries of files that no longer exist"""
+    cache = {path: entry for path, entry in cache.items() if os.path.exists(path)}
+    try:
+        cache_dir = os.path.dirname(CACHE_FILE)
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+        os.replace(temp_path, CACHE_FILE)
+    except OSError:
+        # -- the cache is only an optimisation
+        pass
+
+
+def sequence_stats(path) -> dict:
+    """Return {'records': int, 'residues': int} of a FASTA/FASTQ file (zeros if missing or not a regular file)"""
+    path = os.path.abspath(str(path))
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        return {'records': 0, 'residues': 0}
+    if not stat.S_ISREG(file_stat.st_mode):
+        return {'records': 0, 'residues': 0}
+
+    cache = _load_cache()
+    entry = cache.get(path)
+    if entry and entry['size'] == file_stat.st_size and entry['mtime_ns'] == file_stat.st_mtime_ns:
+        return {'records': entry['records'], 'residues': entry['residues']}
+
+    stats = _scan_fastq(path) if is_fastq(path) else _scan_fasta(path)
+
+    cache[path] = dict(stats, size=file_stat.st_size, mtime_ns=file_stat.st_mtime_ns)
+    _save_cache(cache)
+    return stats
+
+
+def count_records(path) -> int:
+    """Number of sequences in a FASTA/FASTQ file"""
+    return sequence_stats(path)['records']
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python seq_stats.py <file> [<file> ...]", file=sys.stderr)
+        sys.exit(1)
+
+    print(json.dumps({file: sequence_stats(file) for file in sys.argv[1:]}, indent=2))
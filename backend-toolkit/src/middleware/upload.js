@@ -31,14 +31,22 @@ const storage = multer.diskStorage({
 // File filter
 const fileFilter = (req, file, cb) => {
   const allowedExtensions = [".fq", ".fastq", ".fa", ".fasta", ".csv"];
-  const ext = path.extname(file.originalname).toLowerCase();
+  const compressedExtensions = [".fq.gz", ".fastq.gz"];
+  const name = file.originalname.toLowerCase();
+  const ext = path.extname(name);
 
-  if (allowedExtensions.includes(ext)) {
+  if (
+    allowedExtensions.includes(ext) ||
+    compressedExtensions.some((compressedExt) => name.endsWith(compressedExt))
+  ) {
     cb(null, true);
   } else {
     cb(
       new Error(
-        `File type not allowed. Allowed types: ${allowedExtensions.join(", ")}`
+        `File type not allowed. Allowed types: ${[
+          ...allowedExtensions,
+          ...compressedExtensions,
+        ].join(", ")}`
       ),
       false
     );
@@ -185,8 +185,7 @@ const pipelineSchema = Joi.object({
       Joi.string(), // species name
       Joi.number().integer().min(0).max(50) // max mismatch value
     )
-    .min(1)
-    .max(1)
+    .min(1) // several species are demultiplexed in a single pass
     .required()
     .default({}),
   minLength: Joi.number().integer().min(1).max(10000).required().default(200),
@@ -197,6 +196,15 @@ const pipelineSchema = Joi.object({
     .optional()
     .allow(null)
     .default(null),
+  maxExpectedErrors: Joi.number().min(0).max(1000).optional().allow(null).default(null),
+  // -- length-filter while PEAR merges; the numpy engine has no streaming mode
+  streamFilter: Joi.boolean()
+    .optional()
+    .default(false)
+    .when("mergeEngine", { is: "numpy", then: Joi.valid(false) }),
+  mergeEngine: Joi.string().valid("pear", "numpy").optional().default("pear"),
+  kmerFastPath: Joi.string().valid("off", "on", "verify").optional().default("off"), // exact-match reads skip blastn
+  compactReference: Joi.string().valid("off", "identical", "contained").optional().default("off"),
   ncbiReferenceFile: Joi.string().required(),
   keyword: Joi.string().optional().allow("").default(""),
   identity: Joi.number().integer().min(0).max(100).required().default(98),
@@ -230,6 +238,11 @@ router.post("/pipeline/start", async (req, res, next) => {
       qualityConfig,
       minLength,
       maxLength,
+      maxExpectedErrors,
+      streamFilter,
+      mergeEngine,
+      kmerFastPath,
+      compactReference,
       ncbiReferenceFile,
       keyword,
       identity,
@@ -259,6 +272,11 @@ router.post("/pipeline/start", async (req, res, next) => {
       qualityConfig,
       minLength,
       maxLength,
+      maxExpectedErrors,
+      streamFilter,
+      mergeEngine,
+      kmerFastPath,
+      compactReference,
       ncbiReferenceFile,
       identity,
       copyNumber,
@@ -47,19 +47,19 @@ export class PythonExecutor {
       {
         name: "pear",
         script: "Step2/joinPear.py",
-        requiredFiles: [],
+        requiredFiles: ["mergeEngine", "streamFilter"],
         outputDirs: ["pear"],
       },
       {
         name: "length filter",
         script: "Step2/lenFilter.py",
-        requiredFiles: ["minLength", "maxLength"],
+        requiredFiles: ["minLength", "maxLength", "maxExpectedErrors"],
         outputDirs: ["filter", "filter_del"],
       },
       {
         name: "blast",
         script: "Step3/joinBlast.py",
-        requiredFiles: ["ncbiReference"],
+        requiredFiles: ["ncbiReference", "compactReference", "kmerFastPath"],
         outputDirs: ["blast"],
       },
       {
@@ -190,6 +190,11 @@ export class PythonExecutor {
       qualityConfig = {},
       minLength = 200,
       maxLength = null,
+      maxExpectedErrors = null,
+      streamFilter = false,
+      mergeEngine = "pear",
+      kmerFastPath = "off",
+      compactReference = "off",
       ncbiReferenceFile,
       keyword,
       identity,
@@ -214,6 +219,11 @@ export class PythonExecutor {
         qualityConfig,
         minLength,
         maxLength,
+        maxExpectedErrors,
+        streamFilter,
+        mergeEngine,
+        kmerFastPath,
+        compactReference,
         ncbiReferenceFile,
         keyword,
         identity,
@@ -251,6 +261,11 @@ export class PythonExecutor {
             qualityConfigFile: qualityConfigFileName,
             minLength,
             maxLength,
+            maxExpectedErrors,
+            streamFilter,
+            mergeEngine,
+            kmerFastPath,
+            compactReference,
             ncbiReferenceFile,
             keyword,
             identity,
@@ -318,6 +333,11 @@ export class PythonExecutor {
       qualityConfigFile,
       minLength,
       maxLength,
+      maxExpectedErrors,
+      streamFilter,
+      mergeEngine,
+      kmerFastPath,
+      compactReference,
       ncbiReferenceFile,
       keyword,
       identity,
@@ -348,11 +368,51 @@ export class PythonExecutor {
             containerArgs.push(parseInt(maxLength));
           }
           break;
+        case "mergeEngine":
+          if (mergeEngine && mergeEngine !== "pear") {
+            containerArgs.push("--engine", mergeEngine);
+          }
+          break;
+        case "streamFilter":
+          // -- PEAR hands its assembled reads straight to the length filter (pear engine only)
+          if (streamFilter && mergeEngine !== "numpy") {
+            containerArgs.push("--stream-filter", parseInt(minLength));
+            if (maxLength !== null && maxLength !== undefined) {
+              containerArgs.push(parseInt(maxLength));
+            }
+            if (maxExpectedErrors !== null && maxExpectedErrors !== undefined) {
+              containerArgs.push("--max-ee", parseFloat(maxExpectedErrors));
+            }
+          }
+          break;
+        case "maxExpectedErrors":
+          if (maxExpectedErrors !== null && maxExpectedErrors !== undefined) {
+            containerArgs.push("--max-ee", parseFloat(maxExpectedErrors));
+          }
+          break;
         case "ncbiReference":
           containerArgs.push(
             `/app/data/uploads/${path.basename(ncbiReferenceFile)}`
           );
           break;
+        case "compactReference":
+          // -- one database sequence per species for identical (or contained) references
+          if (compactReference && compactReference !== "off") {
+            containerArgs.push("--compact-reference", compactReference);
+          }
+          break;
+        case "kmerFastPath":
+          if (kmerFastPath === "on" || kmerFastPath === "verify") {
+            containerArgs.push(kmerFastPath === "on" ? "--kmer-fast-path" : "--verify-fast-path");
+            // -- the fast path must assign reads as the assign species step will
+            if (identity !== null && identity !== undefined) {
+              containerArgs.push("--identity", parseInt(identity));
+            }
+            if (keyword && keyword.toString().trim()) {
+              containerArgs.push("--keyword", keyword.toString().trim());
+            }
+          }
+          break;
         case "keyword":
           containerArgs.push(keyword ? keyword.toString() : "");
           break;
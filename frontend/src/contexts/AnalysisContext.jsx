@@ -23,6 +23,7 @@ export function AnalysisProvider({ children }) {
   // Configuration State
   const [minLength, setMinLength] = useState(200);
   const [maxLength, setMaxLength] = useState();
+  const [maxExpectedErrors, setMaxExpectedErrors] = useState();
   const [ncbiFile, setNcbiFile] = useState(null);
   const [keyword, setKeyword] = useState();
   const [identity, setIdentity] = useState(98);
@@ -194,6 +195,7 @@ export function AnalysisProvider({ children }) {
     setQualityConfig({});
     setMinLength(200);
     setMaxLength();
+    setMaxExpectedErrors();
     setIsAnalyzing(false);
     setNcbiFile(null);
     setKeyword('');
@@ -249,6 +251,7 @@ export function AnalysisProvider({ children }) {
     showLogs,
     minLength,
     maxLength,
+    maxExpectedErrors,
     ncbiFile,
     keyword,
     identity,
@@ -269,6 +272,7 @@ export function AnalysisProvider({ children }) {
     setShowLogs,
     setMinLength,
     setMaxLength,
+    setMaxExpectedErrors,
     setNcbiFile,
     setKeyword,
     setIdentity,
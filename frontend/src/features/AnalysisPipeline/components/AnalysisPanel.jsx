@@ -19,6 +19,7 @@ const AnalysisPanel = ({ uploadedFiles, onAnalysisComplete, onReset }) => {
     showLogs,
     minLength,
     maxLength,
+    maxExpectedErrors,
     ncbiFile,
     keyword,
     identity,
@@ -32,6 +33,7 @@ const AnalysisPanel = ({ uploadedFiles, onAnalysisComplete, onReset }) => {
     setShowLogs,
     setMinLength,
     setMaxLength,
+    setMaxExpectedErrors,
     setNcbiFile,
     setKeyword,
     setIdentity,
@@ -169,6 +171,7 @@ const AnalysisPanel = ({ uploadedFiles, onAnalysisComplete, onReset }) => {
         qualityConfig: currentRunConfig,
         minLength: minLength,
         maxLength: maxLength || null,
+        maxExpectedErrors: maxExpectedErrors || maxExpectedErrors === 0 ? maxExpectedErrors : null,
         ncbiReferenceFile: `uploads/${uploadedFilename}`,
         keyword: keyword,
         identity: identity,
@@ -201,6 +204,11 @@ const AnalysisPanel = ({ uploadedFiles, onAnalysisComplete, onReset }) => {
     setMaxLength(parsedValue)
   }
 
+  const handleMaxExpectedErrorsChange = (value) => {
+    const parsedValue = parseFloat(value)
+    setMaxExpectedErrors(parsedValue)
+  }
+
   const handleNCBIFileChange = (event) => {
     const file = event.target.files[0]
     setNcbiFile(file)
@@ -247,6 +255,10 @@ const AnalysisPanel = ({ uploadedFiles, onAnalysisComplete, onReset }) => {
     const maxLengthValid = !maxLength || 
       (maxLength > 0 && maxLength > minLength && maxLength <= 10000)
 
+    // 0-1000 (optional)
+    const maxExpectedErrorsValid = !maxExpectedErrors || 
+      (maxExpectedErrors >= 0 && maxExpectedErrors <= 1000)
+
     // 0-100
     const identityValid = identity >= 0 && identity <= 100
 
@@ -257,7 +269,8 @@ const AnalysisPanel = ({ uploadedFiles, onAnalysisComplete, onReset }) => {
           minLengthValid && 
           identityValid && 
           copyNumberValid && 
-          maxLengthValid
+          maxLengthValid &&
+          maxExpectedErrorsValid
   }
 
   // Handle Reset
@@ -385,6 +398,21 @@ const AnalysisPanel = ({ uploadedFiles, onAnalysisComplete, onReset }) => {
                     <span className="input-suffix">bp (optional)</span>
                   </span>
                 </span>
+                <span className='maximum-length-container'>Discard reads with expected errors above
+                  <span className="input-group">
+                    <input
+                      id="expected-error-filter"
+                      type="number"
+                      min="0"
+                      max="1000"
+                      step="0.1"
+                      defaultValue={maxExpectedErrors}
+                      onChange={(e) => handleMaxExpectedErrorsChange(e.target.value)}
+                      className="minimum-length"
+                    />
+                    <span className="input-suffix">(optional)</span>
+                  </span>
+                </span>
               </div>
             </div>
           </div>
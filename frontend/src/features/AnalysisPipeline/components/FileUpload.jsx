@@ -37,6 +37,7 @@ const FileUpload = ({ onFilesUploaded }) => {
     onDrop,
     accept: {
       'text/plain': ['.fq', '.fastq'],
+      'application/gzip': ['.fq.gz', '.fastq.gz'],
       'text/csv': ['.csv']
     },
     multiple: true
@@ -130,13 +131,13 @@ const FileUpload = ({ onFilesUploaded }) => {
           <div className="drop-active">
             <Upload size={48} />
             <p>Drop files here...</p>
-            <small>Supported: .fq, .fastq, .csv</small>
+            <small>Supported: .fq, .fastq, .fq.gz, .fastq.gz, .csv</small>
           </div>
         ) : (
           <div className="drop-idle">
             <Upload size={48} />
             <p>Drag & drop files here, or click to select</p>
-            <small>Supported: .fq, .fastq, .csv</small>
+            <small>Supported: .fq, .fastq, .fq.gz, .fastq.gz, .csv</small>
           </div>
         )}
       </div>